@@ -26,10 +26,16 @@ import re
 import urlparse
 import glob
 import gzip
+import json
+import hashlib
+import multiprocessing
 import xml.etree.cElementTree as ET
 
-from gitbuildsys.utils import Temp, RepoParser, read_localconf, \
-                              guess_spec, show_file_from_rev
+from gitbuildsys.utils import Temp, RepoParser, HttpCache, read_localconf, \
+                              guess_spec, show_file_from_rev, parse_spec, \
+                              pool_map, SPEC_PARSE_STATS, \
+                              spec_parse_stats_since, merge_spec_parse_stats, \
+                              log_spec_parse_stats
 from gitbuildsys.errors import GbsError, Usage
 from gitbuildsys.conf import configmgr
 from gitbuildsys.safe_url import SafeURL
@@ -37,8 +43,6 @@ from gitbuildsys.cmd_export import get_packaging_dir, config_is_true
 from gitbuildsys.log import LOGGER as log
 
 from gbp.rpm.git import GitRepositoryError, RpmGitRepository
-from gbp import rpm
-from gbp.errors import GbpError
 
 
 CHANGE_PERSONALITY = {
@@ -63,6 +67,11 @@ SUPPORTEDARCHS = [
     'mipsel',
     ]
 
+# Stop parsing local repos for archs once build arch was seen this many times
+ARCH_SAMPLE_THRESHOLD = 128
+# Index of archs of local repo, see get_local_archs()
+ARCH_INDEX_NAME = '.gbs_archs.json'
+
 USERID = pwd.getpwuid(os.getuid())[0]
 TMPDIR = None
 
@@ -78,10 +87,38 @@ def formalize_build_conf(profile):
     # '-' is not allowed, so replace with '_'
     return profile.replace('-', '_')
 
+def _binary_names_of_package(job):
+    '''get binary rpm names of one package, run in spec parsing pool'''
+    package_dir, packaging_dir, commit, include_all = job
+    names = []
+    before = dict(SPEC_PARSE_STATS)
+    try:
+        main_spec, rest_specs = guess_spec(package_dir, packaging_dir,
+                                           None, commit)
+        rest_specs.append(main_spec)
+        for spec in rest_specs:
+            if include_all:
+                try:
+                    with open(os.path.join(package_dir, spec)) as fobj:
+                        content = fobj.read()
+                except IOError, err:
+                    raise GbsError('failed to read %s: %s' % (spec, err))
+            else:
+                content = show_file_from_rev(package_dir, spec, commit)
+                if content is None:
+                    raise GbsError('failed to checkout %s from commit: %s' %
+                                   (spec, commit))
+
+            names.append(parse_spec(content).name)
+    except GbsError, err:
+        # exceptions don't survive pickling, pass message to parent
+        return None, '%s: %s' % (package_dir, err.args[0]), \
+               spec_parse_stats_since(before)
+    return names, None, spec_parse_stats_since(before)
+
 def get_binary_name_from_git(args, package_dirs):
     ''' get binary rpm name from specified git package'''
 
-    binary_list = []
     packaging_dir = get_packaging_dir(args)
     if args.commit:
         commit = args.commit
@@ -90,26 +127,22 @@ def get_binary_name_from_git(args, package_dirs):
     else:
         commit = 'HEAD'
 
-    for package_dir in package_dirs:
-        main_spec, rest_specs = guess_spec(package_dir, packaging_dir,
-                                           None, commit)
-        rest_specs.append(main_spec)
-        for spec in rest_specs:
-            if args.include_all:
-                spec_to_parse = os.path.join(package_dir, spec)
-            else:
-                content = show_file_from_rev(package_dir, spec, commit)
-                if content is None:
-                    raise GbsError('failed to checkout %s from commit: %s' %
-                                   (spec, commit))
-                tmp_spec = Temp(content=content)
-                spec_to_parse = tmp_spec.path
+    jobs = [(package_dir, packaging_dir, commit, args.include_all)
+            for package_dir in package_dirs]
+    workers = min(multiprocessing.cpu_count(), len(jobs))
+    if workers > 1:
+        results = pool_map(_binary_names_of_package, jobs, workers)
+        for _names, _error, stats in results:
+            merge_spec_parse_stats(stats)
+    else:
+        results = [_binary_names_of_package(job) for job in jobs]
+    log_spec_parse_stats()
 
-            try:
-                spec = rpm.SpecFile(spec_to_parse)
-            except GbpError, err:
-                raise GbsError('%s' % err)
-            binary_list.append(spec.name)
+    binary_list = []
+    for names, error, _stats in results:
+        if error:
+            raise GbsError(error)
+        binary_list.extend(names)
 
     return binary_list
 
@@ -147,11 +180,12 @@ def prepare_repos_and_build_conf(args, arch, profile):
     if not repos:
         raise GbsError('No package repository specified.')
 
-    archs = get_local_archs(repos)
+    archs = get_local_archs(repos, arch)
     if arch not in archs:
         log.warning('No local package repository for arch %s' % arch)
 
-    repoparser = RepoParser(repos, cachedir)
+    httpcache = HttpCache(os.path.join(TMPDIR, 'httpcache'))
+    repoparser = RepoParser(repos, cachedir, httpcache)
     repourls = repoparser.get_repos_by_arch(arch)
     if not repourls:
         raise GbsError('no available repositories found for arch %s under the '
@@ -294,7 +328,44 @@ def get_profile(args):
         profile = configmgr.get_current_profile()
     return profile
 
-def get_local_archs(repos):
+def _arch_index_paths(repo):
+    """Candidate paths of arch index of local repo, sidecar one first."""
+    return [os.path.join(repo, ARCH_INDEX_NAME),
+            os.path.join(TMPDIR, 'archindex', '%s.json' %
+                         hashlib.sha1(os.path.abspath(repo)).hexdigest())]
+
+def load_arch_index(repo, checksum):
+    """Load arch index of local repo, None if missing or outdated."""
+    for path in _arch_index_paths(repo):
+        try:
+            with open(path) as fobj:
+                index = json.load(fobj)
+        except (IOError, ValueError):
+            continue
+        if isinstance(index, dict) and index.get('checksum') == checksum:
+            return index
+    return None
+
+def save_arch_index(repo, index):
+    """
+    Save arch index of local repo next to it, or under TMPDIR if the repo
+    is not writable.
+    """
+    for path in _arch_index_paths(repo):
+        tmp_path = '%s.%d' % (path, os.getpid())
+        try:
+            if not os.path.exists(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            with open(tmp_path, 'w') as fobj:
+                json.dump(index, fobj)
+            os.rename(tmp_path, path)
+            return
+        except (IOError, OSError), err:
+            log.debug('failed to save arch index to %s: %s' % (path, err))
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+
+def get_local_archs(repos, arch=None):
     """
     Get the supported arch from prebuilt toolchains
       > get primary file
@@ -302,36 +373,92 @@ def get_local_archs(repos):
 
     Each toolchain should contain about 128 packages,
     it is insufficient if less than that.
+
+    primary.xml is parsed as a stream, so memory usage doesn't depend on
+    the size of repos. Parsing stops early once all supported archs have
+    been found, or once given arch has been seen ARCH_SAMPLE_THRESHOLD
+    times, as the caller only needs to know if it's there.
+
+    Package counts per arch are saved in an index keyed by checksum of
+    repomd.xml, so primary.xml is parsed again only after the repo has
+    been regenerated.
     """
-    def get_primary_file_from_local(repos):
-        def find_primary(repo):
-            pattern = os.path.join(repo, 'repodata', '*primary.*.gz')
-            files = glob.glob(pattern)
-            if files:
-                return files[0]
-
-        for repo in repos:
-            if not repo.startswith('http'):
-                pri = find_primary(repo)
-                if pri:
-                    yield pri
-
-    def extract_arch(primary):
+    def find_primary(repo):
+        pattern = os.path.join(repo, 'repodata', '*primary.*.gz')
+        files = glob.glob(pattern)
+        if files:
+            return files[0]
+
+    def repomd_checksum(repo):
+        """Checksum of repomd.xml, None if repo has no one."""
+        try:
+            with open(os.path.join(repo, 'repodata', 'repomd.xml')) as fobj:
+                return hashlib.sha256(fobj.read()).hexdigest()
+        except IOError:
+            return None
+
+    def enough(counts):
+        """Check if no more parsing is needed."""
+        if arch and counts.get(arch, 0) >= ARCH_SAMPLE_THRESHOLD:
+            return True
+        return not set(SUPPORTEDARCHS).difference(counts)
+
+    def count_archs(primary):
+        """
+        Count packages of each arch in primary until enough.
+        Returns: tuple of counts and whether whole primary was parsed.
+        """
+        counts = {}
         with gzip.open(primary) as fobj:
-            root = ET.fromstring(fobj.read())
-
-        xmlns = re.sub(r'metadata$', '', root.tag)
-        for elm in root.getiterator('%spackage' % xmlns):
-            arch = elm.find('%sarch' % xmlns).text
-            if re.match(r'i[3-6]86', arch):
-                yield 'i586'
-            elif arch not in ('noarch', 'src'):
-                yield arch
+            root = xmlns = None
+            for event, elem in ET.iterparse(fobj, events=('start', 'end')):
+                if root is None:
+                    root = elem
+                    xmlns = re.sub(r'metadata$', '', root.tag)
+                if event != 'end' or elem.tag != '%spackage' % xmlns:
+                    continue
+
+                pkg_arch = elem.findtext('%sarch' % xmlns)
+                # drop parsed packages to keep memory usage flat
+                root.clear()
+                if not pkg_arch:
+                    continue
+                if re.match(r'i[3-6]86', pkg_arch):
+                    pkg_arch = 'i586'
+                elif pkg_arch in ('noarch', 'src'):
+                    continue
+                counts[pkg_arch] = counts.get(pkg_arch, 0) + 1
+                if enough(counts):
+                    return counts, False
+        return counts, True
+
+    def get_counts(repo):
+        """Get package counts per arch of local repo."""
+        checksum = repomd_checksum(repo)
+        index = load_arch_index(repo, checksum) if checksum else None
+        if index and (index['complete'] or enough(index['archs'])):
+            return index['archs']
+
+        primary = find_primary(repo)
+        if not primary:
+            return {}
+        counts, complete = count_archs(primary)
+        if checksum:
+            save_arch_index(repo, {'checksum': checksum,
+                                   'archs': counts,
+                                   'complete': complete})
+        return counts
 
     archs = set()
-    for pri in get_primary_file_from_local(repos):
-        for arch in extract_arch(pri):
-            archs.add(arch)
+    total = {}
+    for repo in repos:
+        if repo.startswith('http'):
+            continue
+        for repo_arch, count in get_counts(repo).iteritems():
+            archs.add(repo_arch)
+            total[repo_arch] = total.get(repo_arch, 0) + count
+        if enough(total):
+            break
 
     return archs
 
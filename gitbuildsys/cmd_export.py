@@ -21,21 +21,34 @@
 
 import os
 import re
+import copy
+import json
+import time
 import shutil
-import glob
 import errno
+import hashlib
+import subprocess
+import multiprocessing
+import xml.etree.cElementTree as ET
+from collections import OrderedDict
 from urlparse import urlparse
 
 from gitbuildsys import utils
 from gitbuildsys.conf import configmgr
-from gitbuildsys.errors import GbsError, Usage
+from gitbuildsys.errors import CmdError, GbsError, Usage
 from gitbuildsys.log import LOGGER as log
 
 from gbp.scripts.buildpackage_rpm import main as gbp_build
+import gbp.scripts.buildpackage_rpm as gbp_buildpackage_rpm
+import gbp.scripts.pq_rpm as gbp_pq_rpm
+try:
+    from gbp.pkg.pristinetar import PristineTar
+except ImportError:
+    PristineTar = None
 from gbp.rpm.git import GitRepositoryError, RpmGitRepository
-import gbp.rpm as rpm
-from gbp.errors import GbpError
 
+# gbp config files, which can change exported files
+GBP_CONF_FILES = ['/etc/git-buildpackage/gbp.conf', '~/.gbp.conf']
 
 def mkdir_p(path):
     """
@@ -102,6 +115,36 @@ def untrack_export_branches(repo, branches):
     for branch in branches:
         repo.delete_branch(branch)
 
+def get_compression_conf(args):
+    """
+    Get compression level and threads of generated tarballs, from the
+    profile in use or general section
+    """
+    profile = getattr(args, 'profile', None)
+    if profile:
+        if not profile.startswith('profile.'):
+            profile = 'profile.' + profile
+    else:
+        profile = configmgr.get_optional_item('general', 'profile')
+
+    values = []
+    for opt, minimum, maximum in [('compression_level', 1, 9),
+                                  ('compression_threads', 0, 1024)]:
+        value = None
+        if profile:
+            value = configmgr.get_optional_item(profile, opt)
+        if not value:
+            value = configmgr.get(opt, 'general')
+        try:
+            value = int(value)
+        except ValueError:
+            value = None
+        if value is None or not minimum <= value <= maximum:
+            raise GbsError('invalid %s, it should be a number between %d '
+                           'and %d' % (opt, minimum, maximum))
+        values.append(value)
+    return tuple(values)
+
 def create_gbp_export_args(repo, commit, export_dir, tmp_dir, spec, args,
                            force_native=False, create_tarball=True):
     """
@@ -138,13 +181,14 @@ def create_gbp_export_args(repo, commit, export_dir, tmp_dir, spec, args,
         reponame = urlparse(remotes[remotename][0]).path.lstrip('/')
 
     packaging_dir = get_packaging_dir(args)
+    compression_level = get_compression_conf(args)[0]
     # Now, start constructing the argument list
     export_rev = commit
     argv = ["argv[0] placeholder",
             "--git-color-scheme=magenta:green:yellow:red",
             "--git-notify=off",
             "--git-ignore-new",
-            "--git-compression-level=6",
+            "--git-compression-level=%d" % compression_level,
             "--git-export-dir=%s" % export_dir,
             "--git-tmp-dir=%s" % tmp_dir,
             "--git-packaging-dir=%s" % packaging_dir,
@@ -208,9 +252,171 @@ def create_gbp_export_args(repo, commit, export_dir, tmp_dir, spec, args,
 
     return argv
 
-def export_sources(repo, commit, export_dir, spec, args, create_tarball=True):
+def export_cache_key(repo, commit, spec, gbp_args, args, snapshot=None):
+    """
+    Get key of export cache from sha1 of exported commits and spec blob,
+    refs gbp resolves upstream sources from, gbp options and configs.
+    Working copy is keyed by its snapshot commit, if given.
+    Returns None if the export can't be cached.
+    """
+    if commit == 'WC.UNTRACKED':
+        if not snapshot:
+            return None
+        commit = snapshot
+    reader = utils.get_git_reader(repo.path)
+    orphan_packaging = configmgr.get('packaging_branch', 'orphan-devel')
+    key = hashlib.sha1()
+    for rev in [commit, orphan_packaging]:
+        if not rev:
+            continue
+        sha1 = reader.rev_parse('%s^{commit}' % rev)
+        if sha1 is None:
+            return None
+        key.update('%s\n' % sha1)
+    spec_stat = reader.stat(orphan_packaging or commit, spec)
+    if spec_stat is None:
+        return None
+    key.update('%s\n' % spec_stat[0])
+
+    # upstream tag is formatted from spec version by gbp, so all tags count
+    upstream_branch = configmgr.get_arg_conf(args, 'upstream_branch')
+    try:
+        proc = subprocess.Popen(['git', 'for-each-ref', 'refs/tags',
+                                 'refs/heads/%s' % upstream_branch,
+                                 'refs/heads/pristine-tar'],
+                                stdout=subprocess.PIPE, cwd=repo.path)
+    except OSError:
+        return None
+    key.update(proc.communicate()[0])
+    if proc.returncode:
+        return None
+
+    for arg in gbp_args[1:]:
+        if not arg.startswith(('--git-export-dir=', '--git-tmp-dir=')):
+            key.update('%s\n' % arg)
+    key.update('%s\n' % configmgr.get_arg_conf(args, 'fallback_to_native'))
+    key.update('%s\n' % configmgr.get_arg_conf(args, 'reproducible_tarball'))
+    # parallel compressors don't give the same bytes
+    key.update('%d\n' % get_compression_conf(args)[1])
+    for path in GBP_CONF_FILES + [os.path.join(repo.path, '.gbp.conf'),
+                                  os.path.join(repo.path, '.git',
+                                               'gbp.conf')]:
+        path = os.path.expanduser(path)
+        if os.path.exists(path):
+            with open(path) as fobj:
+                key.update('%s\n%s\n' % (path, fobj.read()))
+    return key.hexdigest()
+
+def make_tarballs_reproducible(repo, commit, export_dir, args):
+    """
+    Normalize tarballs generated by gbp in export_dir, so that exports of
+    identical trees give identical tarballs. Tarballs from packaging dir
+    are left untouched. Time of the exported commit is used only for
+    tarballs git archive didn't make from a commit.
+    """
+    if commit == 'WC.UNTRACKED':
+        commit = 'HEAD'
+    orphan_packaging = configmgr.get('packaging_branch', 'orphan-devel')
+    packaging_dir, files = utils.list_packaging_dir_in_rev(
+        repo.path, get_packaging_dir(args), orphan_packaging or commit)
+    packaged = set(os.path.relpath(path, packaging_dir) for path in files)
+
+    mtime = utils.get_git_reader(repo.path).commit_time(commit)
+    if mtime is None:
+        raise GbsError('failed to get time of commit %s' % commit)
+    compression_level = get_compression_conf(args)[0]
+    for name in os.listdir(export_dir):
+        if name not in packaged and \
+                utils.normalize_tarball(os.path.join(export_dir, name), mtime,
+                                        compression_level):
+            log.debug('normalized tarball %s' % name)
+
+def cached_format_patch(format_patch):
+    """
+    Wrap format_patch() of gbp, which formats one commit into the patch
+    series, with the patch cache. Patches are keyed by commit sha1, format
+    options and names of preceding patches, which file name depends on.
     """
-    Export packaging files using git-buildpackage
+    cache = utils.PatchCache(utils.get_cachedir('patchcache'))
+
+    def wrapper(outdir, repo, commit_info, series, *args, **kwargs):
+        """format_patch() of gbp, using patches of cache if possible"""
+        key = hashlib.sha1()
+        key.update('%s\n%r\n%r\n' % (commit_info['id'], args,
+                                        sorted(kwargs.items())))
+        for patch in series:
+            key.update('%s\n' % os.path.relpath(patch, outdir))
+        key = key.hexdigest()
+
+        hit, patch = cache.get(key, outdir)
+        if hit:
+            if patch:
+                series.append(patch)
+            return patch
+        patch = format_patch(outdir, repo, commit_info, series,
+                             *args, **kwargs)
+        cache.put(key, outdir, patch)
+        return patch
+
+    wrapper.gbs_cached = True
+    return wrapper
+
+def install_patch_cache():
+    """Make gbp format patches of commits through the patch cache"""
+    for module in [gbp_pq_rpm, gbp_buildpackage_rpm]:
+        format_patch = getattr(module, 'format_patch', None)
+        if format_patch and not getattr(format_patch, 'gbs_cached', False):
+            module.format_patch = cached_format_patch(format_patch)
+
+def cached_pristine_tar_checkout(checkout):
+    """
+    Wrap PristineTar.checkout() of gbp with the pristine tarball cache.
+    Tarballs are keyed by blobs of their delta and tree id on pristine-tar
+    branch, so the same upstream tarball is regenerated only once.
+    """
+    cache = utils.ExportCache(utils.get_cachedir('pristinetarcache'))
+
+    def wrapper(self, archive, *args, **kwargs):
+        """PristineTar.checkout() of gbp, using tarballs of cache"""
+        repo = getattr(self, 'repo', None)
+        if args or kwargs or repo is None:
+            # unknown API of gbp
+            return checkout(self, archive, *args, **kwargs)
+        reader = utils.get_git_reader(repo.path)
+        name = os.path.basename(archive)
+        blobs = [reader.stat('pristine-tar', '%s.%s' % (name, suffix))
+                 for suffix in ('delta', 'id')]
+        if None in blobs:
+            return checkout(self, archive)
+
+        key = hashlib.sha1('%s\n%s\n%s\n' % (name, blobs[0][0],
+                                               blobs[1][0])).hexdigest()
+        if cache.get(key, os.path.dirname(archive)):
+            log.debug('using cached pristine tarball %s' % name)
+            return
+        checkout(self, archive)
+        stage = utils.Temp(prefix=os.path.join(
+            os.path.dirname(archive), '.gbs_pristine_'), directory=True)
+        try:
+            os.link(archive, os.path.join(stage.path, name))
+        except OSError:
+            shutil.copy2(archive, stage.path)
+        cache.put(key, stage.path)
+
+    wrapper.gbs_cached = True
+    return wrapper
+
+def install_pristine_tar_cache():
+    """Make gbp check out pristine tarballs through the cache"""
+    checkout = PristineTar and getattr(PristineTar, 'checkout', None)
+    if checkout and not getattr(checkout, 'gbs_cached', False):
+        PristineTar.checkout = cached_pristine_tar_checkout(checkout)
+
+def export_sources(repo, commit, export_dir, spec, args, create_tarball=True,
+                   snapshot=None):
+    """
+    Export packaging files using git-buildpackage. Export of working copy
+    is cached by snapshot, the commit snapshot_working_copy() recorded it as.
     """
     tmp = utils.Temp(prefix='gbp_', dirn=configmgr.get('tmpdir', 'general'),
                      directory=True)
@@ -218,8 +424,20 @@ def export_sources(repo, commit, export_dir, spec, args, create_tarball=True):
     gbp_args = create_gbp_export_args(repo, commit, export_dir, tmp.path,
                                       spec, args, force_native=False,
                                       create_tarball=create_tarball)
+    cache = utils.ExportCache(utils.get_cachedir('exportcache'))
+    key = export_cache_key(repo, commit, spec, gbp_args, args, snapshot)
+    if key and cache.get(key, export_dir):
+        log.info('using cached export of %s' % spec)
+        return
+    threads = get_compression_conf(args)[1]
+    # pristine-tar recreates tarballs byte by byte with stock compressors
+    if '--git-pristine-tar' in gbp_args:
+        threads = 1
+    install_patch_cache()
+    install_pristine_tar_cache()
     try:
-        ret = gbp_build(gbp_args)
+        with utils.CompressionThreads(threads):
+            ret = gbp_build(gbp_args)
         if ret == 2 and not is_native_pkg(repo, args):
             errmsg = ("Generating upstream tarball and/or generating patches "
                       "failed. GBS tried this as you have upstream branch in "
@@ -240,40 +458,305 @@ def export_sources(repo, commit, export_dir, spec, args, create_tarball=True):
                                                   tmp.path, spec, args,
                                                   force_native=True,
                                                   create_tarball=create_tarball)
-                ret = gbp_build(gbp_args)
+                with utils.CompressionThreads(threads):
+                    ret = gbp_build(gbp_args)
             else:
                 log.error(errmsg)
         if ret:
             raise GbsError("Failed to export packaging files from git tree")
     except GitRepositoryError, excobj:
         raise GbsError("Repository error: %s" % excobj)
+    reproducible = configmgr.get_arg_conf(args, 'reproducible_tarball')
+    # tarballs from pristine-tar are reproduced byte by byte already
+    if create_tarball and config_is_true(reproducible) and \
+            '--git-pristine-tar' not in gbp_args:
+        make_tarballs_reproducible(repo, snapshot or commit, export_dir, args)
+    if key:
+        cache.put(key, export_dir)
 
 
+def _export_spec(job):
+    """
+    Export packaging files of a spec, with tarball only for the main spec,
+    run in export pool. Returns error message, None on success.
+    """
+    workdir, commit, snapshot, export_dir, spec, args, create_tarball = job
+    try:
+        repo = RpmGitRepository(workdir)
+        with utils.Workdir(workdir):
+            export_sources(repo, commit, export_dir, spec, args,
+                           create_tarball=create_tarball, snapshot=snapshot)
+    except GbsError, err:
+        return '%s: %s' % (spec, err.args[0])
+    except GitRepositoryError, err:
+        return '%s: %s' % (spec, err)
+    return None
+
+def link_main_export(export_dir, rest_dir, main_spec):
+    """
+    Hardlink files exported for the main spec into export dir of a
+    secondary spec, so that its source rpm finds the tarball. Main spec
+    and source rpm are left out.
+    """
+    for name in os.listdir(export_dir):
+        src_path = os.path.join(export_dir, name)
+        if name == os.path.basename(main_spec) or \
+                name.endswith('.src.rpm') or os.path.islink(src_path) or \
+                not os.path.isfile(src_path):
+            continue
+        dst_path = os.path.join(rest_dir, name)
+        try:
+            os.link(src_path, dst_path)
+        except OSError:
+            shutil.copy2(src_path, dst_path)
+
+def merge_export_dir(src, dst, skip=()):
+    """
+    Move files exported to src into dst, replacing existing ones, except
+    top level names in skip
+    """
+    for name in os.listdir(src):
+        if name in skip:
+            continue
+        src_path = os.path.join(src, name)
+        dst_path = os.path.join(dst, name)
+        if os.path.isdir(src_path) and not os.path.islink(src_path) and \
+                os.path.isdir(dst_path):
+            merge_export_dir(src_path, dst_path)
+        else:
+            if os.path.isdir(dst_path) and not os.path.islink(dst_path):
+                shutil.rmtree(dst_path)
+            elif os.path.isdir(src_path) and os.path.lexists(dst_path):
+                os.unlink(dst_path)
+            os.rename(src_path, dst_path)
+
+def merge_rest_exports(export_dir, main_spec, rest_exports):
+    """
+    Merge exports of secondary specs, given as (spec, dir) pairs, into
+    export_dir of main spec. Later exports overwrite common files, as if
+    they were done in the same dir, but every spec file of the package
+    comes from its own export, not from the unmodified copies gbp puts
+    into each export with the rest of packaging dir.
+    """
+    specfiles = set(os.path.basename(spec) for spec, _dir in rest_exports)
+    specfiles.add(os.path.basename(main_spec))
+    for spec, rest_dir in rest_exports:
+        specfile = os.path.basename(spec)
+        merge_export_dir(rest_dir, export_dir, skip=specfiles)
+        os.rename(os.path.join(rest_dir, specfile),
+                  os.path.join(export_dir, specfile))
+
+def get_export_tmpdir(workdir, outdir):
+    """
+    Get dir to export into, preferring the filesystem of outdir, so that
+    exported files are moved there by rename instead of copying
+    """
+    tmpdir = configmgr.get('tmpdir', 'general')
+    try:
+        outdev = os.stat(outdir).st_dev
+        if os.stat(tmpdir).st_dev == outdev:
+            return tmpdir
+    except OSError:
+        return tmpdir
+    # working copy is exported with --include-all, use git dir instead
+    if not (outdir + os.sep).startswith(workdir.rstrip(os.sep) + os.sep):
+        return outdir
+    gitdir = os.path.join(workdir, '.git')
+    if os.path.isdir(gitdir) and os.stat(gitdir).st_dev == outdev:
+        return gitdir
+    return tmpdir
+
+def parse_repo_manifest(manifest, topdir, projects=None, include_dir=None):
+    """
+    Get paths of git projects listed in manifest of repo tool, following
+    its includes. Included manifests are looked for in include_dir,
+    manifests dir of repo checkout at topdir by default.
+    """
+    try:
+        root = ET.parse(manifest).getroot()
+    except (IOError, SyntaxError), err:
+        raise GbsError('failed to parse manifest %s: %s' % (manifest, err))
+
+    if projects is None:
+        # path => project name
+        projects = OrderedDict()
+    if include_dir is None:
+        include_dir = os.path.join(topdir, '.repo', 'manifests')
+    for elem in root:
+        if elem.tag == 'include' and elem.get('name'):
+            parse_repo_manifest(os.path.join(include_dir, elem.get('name')),
+                                topdir, projects, include_dir)
+        elif elem.tag == 'project' and elem.get('name'):
+            path = elem.get('path') or elem.get('name')
+            projects[os.path.join(topdir, path)] = elem.get('name')
+        elif elem.tag == 'remove-project':
+            for path, name in projects.items():
+                if name == elem.get('name'):
+                    del projects[path]
+    return projects.keys()
+
+def find_git_projects(path):
+    """
+    Find git projects of a manifest of repo tool, a checkout of repo tool
+    or a dir of git projects
+    """
+    path = os.path.abspath(path)
+    if os.path.isfile(path):
+        topdir = os.path.dirname(path)
+        if os.path.basename(topdir) == '.repo':
+            return parse_repo_manifest(path, os.path.dirname(topdir))
+        if os.path.basename(topdir) == 'manifests' and \
+                os.path.basename(os.path.dirname(topdir)) == '.repo':
+            return parse_repo_manifest(path,
+                                       os.path.dirname(os.path.dirname(topdir)))
+        # manifest out of repo checkout, project paths are relative to it
+        return parse_repo_manifest(path, topdir, include_dir=topdir)
+    if not os.path.isdir(path):
+        raise GbsError('no such manifest or dir: %s' % path)
+    manifest = os.path.join(path, '.repo', 'manifest.xml')
+    if os.path.exists(manifest):
+        return parse_repo_manifest(manifest, path)
+
+    projects = []
+    for dirpath, dirnames, _files in os.walk(path):
+        dirnames.sort()
+        if '.git' in dirnames or \
+                os.path.isfile(os.path.join(dirpath, '.git')) or \
+                ('objects' in dirnames and 'refs' in dirnames and
+                 os.path.isfile(os.path.join(dirpath, 'HEAD'))):
+            # working tree or bare repository
+            projects.append(dirpath)
+            # git projects aren't nested
+            del dirnames[:]
+        elif '.repo' in dirnames:
+            dirnames.remove('.repo')
+    return projects
+
+def _batch_export(job):
+    """Export one git project in batch export pool"""
+    project, args = job
+    args = copy.copy(args)
+    args.gitdir = project
+    result = {'project': project, 'status': 'ok', 'outdir': None,
+              'error': None}
+    start = time.time()
+    before = dict(utils.SPEC_PARSE_STATS)
+    try:
+        # local config of project is needed to find its packaging dir,
+        # not the one read by parent process for its gitdir
+        utils.forget_localconfs()
+        repo = RpmGitRepository(project)
+        if repo.bare:
+            utils.read_localconf_from_rev(repo.path, args.commit or 'HEAD')
+        else:
+            utils.read_localconf(repo.path)
+        packaging_dir = get_packaging_dir(args)
+        if args.include_all:
+            found = os.path.isdir(os.path.join(project, packaging_dir))
+        else:
+            found = utils.list_packaging_dir_in_rev(project, packaging_dir,
+                                                    args.commit or 'HEAD')[1]
+        if not found:
+            result['status'] = 'skipped'
+        else:
+            result['outdir'] = export_package(args)
+    except (CmdError, GitRepositoryError), err:
+        result['status'] = 'failed'
+        result['error'] = str(err)
+    except Exception, err:
+        result['status'] = 'failed'
+        result['error'] = '%s: %s' % (type(err).__name__, err)
+    result['seconds'] = round(time.time() - start, 3)
+    result['spec_parsing'] = utils.spec_parse_stats_since(before)
+    return result
+
+def batch_export(args):
+    """
+    Export all git projects of a manifest or dir in a worker pool, and
+    write summary of results in json
+    """
+    if args.threads < 0:
+        raise Usage('--threads must not be negative')
+    projects = find_git_projects(args.batch)
+    if not projects:
+        raise GbsError('no git projects found in %s' % args.batch)
+    summary_path = args.batch_summary or \
+                   os.path.join(os.path.abspath(args.outdir or os.getcwd()),
+                                'gbs-export-summary.json')
+    log.info('exporting %d git projects of %s' % (len(projects), args.batch))
+
+    start = time.time()
+    jobs = [(project, args) for project in projects]
+    # every project gets a fresh process, as local gbs.conf of projects
+    # changes config
+    results = utils.pool_map(_batch_export, jobs,
+                             args.threads or multiprocessing.cpu_count(),
+                             maxtasksperchild=1)
+
+    summary = {'source': os.path.abspath(args.batch),
+               'seconds': round(time.time() - start, 3),
+               'packages': results}
+    for status in ('ok', 'failed', 'skipped'):
+        summary[status] = len([res for res in results
+                               if res['status'] == status])
+    try:
+        with open(summary_path, 'w') as fobj:
+            json.dump(summary, fobj, indent=2)
+    except IOError, err:
+        raise GbsError('failed to write summary %s: %s' % (summary_path, err))
+
+    for res in results:
+        utils.merge_spec_parse_stats(res['spec_parsing'])
+    utils.log_spec_parse_stats()
+    for res in results:
+        if res['status'] == 'failed':
+            log.error('%s: %s' % (res['project'], res['error']))
+    log.info('%d exported, %d failed, %d skipped, summary written to:\n'
+             '     %s' % (summary['ok'], summary['failed'],
+                          summary['skipped'], summary_path))
+    if summary['failed']:
+        raise GbsError('failed to export %d git projects' % summary['failed'])
+
 def main(args):
     """gbs export entry point."""
 
     if args.commit and args.include_all:
         raise Usage("--commit can't be specified together with --include-all")
 
+    if args.batch:
+        batch_export(args)
+    else:
+        export_package(args)
+
+def export_package(args):
+    """
+    Export packaging files of git project args.gitdir
+    Returns: dir packaging files have been exported to
+    """
     workdir = args.gitdir
     try:
         repo = RpmGitRepository(workdir)
     except GitRepositoryError, err:
         raise GbsError(str(err))
 
-    utils.read_localconf(repo.path)
-    utils.git_status_checker(repo, args)
+    status = utils.git_status_checker(repo, args)
     workdir = repo.path
 
 
     # Only guess spec filename here, parse later when we have the correct
     # spec file at hand
+    snapshot = None
     if args.commit:
         commit = args.commit
     elif args.include_all:
         commit = 'WC.UNTRACKED'
+        snapshot = utils.snapshot_working_copy(workdir, status)
     else:
         commit = 'HEAD'
+    if repo.bare:
+        utils.read_localconf_from_rev(workdir, commit)
+    else:
+        utils.read_localconf(workdir)
     orphan_packaging = configmgr.get('packaging_branch', 'orphan-devel')
     spec_commit_id = orphan_packaging if orphan_packaging else commit
     packaging_dir = get_packaging_dir(args)
@@ -282,6 +765,8 @@ def main(args):
 
     if args.outdir:
         outdir = args.outdir
+    elif repo.bare:
+        outdir = os.getcwd()
     else:
         outdir = os.path.join(workdir, packaging_dir)
     outdir = os.path.abspath(outdir)
@@ -291,30 +776,44 @@ def main(args):
     else:
         mkdir_p(outdir)
 
-    tmpdir = configmgr.get('tmpdir', 'general')
+    tmpdir = get_export_tmpdir(workdir, outdir)
     tempd = utils.Temp(prefix=os.path.join(tmpdir, '.gbs_export_'),
                        directory=True)
     export_dir = tempd.path
 
     tracked_branches = track_export_branches(repo, args)
 
-    with utils.Workdir(workdir):
-        export_sources(repo, commit, export_dir, main_spec, args)
-
-        if rest_specs:
-            # backup updated spec file
-            specbakd = utils.Temp(prefix=os.path.join(tmpdir, '.gbs_export_'),
-                                  directory=True)
-            shutil.copy(os.path.join(export_dir, os.path.basename(main_spec)),
-                        specbakd.path)
-            for spec in rest_specs:
-                export_sources(repo, commit, export_dir, spec, args,
-                               create_tarball=False)
-                shutil.copy(os.path.join(export_dir, os.path.basename(spec)),
-                            specbakd.path)
-            # restore updated spec files
-            for spec in glob.glob(os.path.join(specbakd.path, "*.spec")):
-                shutil.copy(spec, export_dir)
+    # secondary specs are exported in their own dirs by a process pool,
+    # concurrently with the main spec
+    rest_dirs = [utils.Temp(prefix=os.path.join(tmpdir, '.gbs_export_'),
+                            directory=True) for _spec in rest_specs]
+    # workers of batch export can't have their own pool, and rpmbuild of
+    # secondary specs needs the tarball exported for the main spec
+    if rest_specs and not args.source_rpm and \
+            not multiprocessing.current_process().daemon:
+        jobs = [(workdir, commit, snapshot, export_dir, main_spec, args, True)]
+        jobs.extend((workdir, commit, snapshot, rest_dir.path, spec, args,
+                     False) for spec, rest_dir in zip(rest_specs, rest_dirs))
+        errors = [err for err in
+                  utils.pool_map(_export_spec, jobs,
+                                 min(multiprocessing.cpu_count(), len(jobs)))
+                  if err]
+        if errors:
+            raise GbsError('\n'.join(errors))
+    else:
+        with utils.Workdir(workdir):
+            export_sources(repo, commit, export_dir, main_spec, args,
+                           snapshot=snapshot)
+        for spec, rest_dir in zip(rest_specs, rest_dirs):
+            if args.source_rpm:
+                link_main_export(export_dir, rest_dir.path, main_spec)
+            with utils.Workdir(workdir):
+                export_sources(repo, commit, rest_dir.path, spec, args,
+                               create_tarball=False, snapshot=snapshot)
+
+    merge_rest_exports(export_dir, main_spec,
+                       [(spec, rest_dir.path)
+                        for spec, rest_dir in zip(rest_specs, rest_dirs)])
 
     # Remove tracked export branches
     if tracked_branches:
@@ -322,9 +821,10 @@ def main(args):
 
     specfile = os.path.basename(main_spec)
     try:
-        spec = rpm.SpecFile(os.path.join(export_dir, specfile))
-    except GbpError, err:
-        raise GbsError('%s' % err)
+        with open(os.path.join(export_dir, specfile)) as fobj:
+            spec = utils.parse_spec(fobj.read())
+    except IOError, err:
+        raise GbsError('failed to read exported %s: %s' % (specfile, err))
 
     if not spec.name or not spec.version:
         raise GbsError('can\'t get correct name or version from spec file.')
@@ -342,3 +842,4 @@ def main(args):
                  (outdir, os.path.basename(outdir)))
 
     log.info('package files have been exported to:\n     %s' % outdir)
+    return outdir
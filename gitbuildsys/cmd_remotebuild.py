@@ -20,6 +20,7 @@
 """
 
 import os
+import sys
 import glob
 
 from gitbuildsys import utils
@@ -32,9 +33,7 @@ from gitbuildsys.cmd_build import get_profile
 from gitbuildsys.log import LOGGER as log
 from gitbuildsys.log import DEBUG
 
-import gbp.rpm
 from gbp.rpm.git import GitRepositoryError, RpmGitRepository
-from gbp.errors import GbpError
 
 OSCRC_TEMPLATE = """[general]
 apiurl = %(apiurl)s
@@ -49,6 +48,37 @@ passx=%(passwdx)s
 """
 
 
+def watch_results(api, target_prj, package):
+    """
+    Print build results of package and then their changes until all of
+    them are final. Return 0 if all builds have succeeded, 1 if any
+    failed or there are no results.
+    """
+    last = {}
+    log.info('watching build results of %s/%s ...' % (target_prj, package))
+    for status in api.watch_results(target_prj, package):
+        for build_repo in sorted(status.keys()):
+            for arch in sorted(status[build_repo]):
+                stat = status[build_repo][arch]
+                old = last.get(build_repo, {}).get(arch)
+                if old is None:
+                    log.info('%-15s%-15s%s' % (build_repo, arch, stat))
+                elif old != stat:
+                    log.info('%-15s%-15s%s -> %s' % (build_repo, arch,
+                                                     old, stat))
+        last = status
+
+    if not last:
+        log.error('no build results from build server')
+        return 1
+    for build_repo in last:
+        for arch in last[build_repo]:
+            if last[build_repo][arch] not in ('succeeded', 'disabled',
+                                              'excluded'):
+                return 1
+    return 0
+
+
 def main(args):
     """gbs remotebuild entry point."""
 
@@ -68,6 +98,13 @@ def main(args):
         raise Usage('--commit can\'t be specified together with '
                     '--include-all')
 
+    if args.follow and not args.buildlog:
+        raise Usage('--follow can only be used together with --buildlog')
+
+    if args.watch and (args.buildlog or args.status):
+        raise Usage('--watch can\'t be specified together with '
+                    '--buildlog or --status')
+
     obs_repo = args.repository
     obs_arch = args.arch
 
@@ -81,41 +118,46 @@ def main(args):
 
     workdir = repo.path
 
-    utils.read_localconf(workdir)
-
-    if not (args.buildlog or args.status):
-        utils.git_status_checker(repo, args)
-
-    packaging_dir = get_packaging_dir(args)
+    status = None
+    if not (args.buildlog or args.status or args.watch):
+        status = utils.git_status_checker(repo, args)
 
+    snapshot = None
     if args.commit:
         commit = args.commit
     elif args.include_all:
         commit = 'WC.UNTRACKED'
+        if status:
+            snapshot = utils.snapshot_working_copy(workdir, status)
     else:
         commit = 'HEAD'
 
+    if repo.bare:
+        utils.read_localconf_from_rev(workdir, commit)
+    else:
+        utils.read_localconf(workdir)
+
+    packaging_dir = get_packaging_dir(args)
+
     relative_spec = utils.guess_spec(workdir, packaging_dir,
                                      args.spec, commit)[0]
 
     if args.include_all:
         # include_all means to use work copy,
         # otherwise use the reversion in git history
-        spec_to_parse = os.path.join(workdir, relative_spec)
+        try:
+            with open(os.path.join(workdir, relative_spec)) as fobj:
+                content = fobj.read()
+        except IOError, err:
+            raise GbsError('failed to read %s: %s' % (relative_spec, err))
     else:
         content = utils.show_file_from_rev(workdir, relative_spec, commit)
         if content is None:
             raise GbsError('failed to checkout %s from commit: %s' %
                            (relative_spec, commit))
 
-        tmp_spec = utils.Temp(content=content)
-        spec_to_parse = tmp_spec.path
-
     # get 'name' and 'version' from spec file
-    try:
-        spec = gbp.rpm.SpecFile(spec_to_parse)
-    except GbpError, err:
-        raise GbsError('%s' % err)
+    spec = utils.parse_spec(content)
 
     if not spec.name:
         raise GbsError("can't get correct name.")
@@ -175,7 +217,11 @@ def main(args):
                                                   status[obs_repo][obs_arch]))
             log.info('build log for %s/%s/%s/%s' % (target_prj, package,
                                                     obs_repo, obs_arch))
-            print api.get_buildlog(target_prj, package, obs_repo, obs_arch)
+            for chunk in api.iter_buildlog(target_prj, package, obs_repo,
+                                           obs_arch, follow=args.follow):
+                sys.stdout.write(chunk)
+                sys.stdout.flush()
+            print
 
             return 0
 
@@ -195,11 +241,15 @@ def main(args):
                 log.info('no build results from build server')
             return 0
 
+        if args.watch:
+            return watch_results(api, target_prj, package)
+
     except OSCError, err:
         raise GbsError(str(err))
 
     with utils.Workdir(workdir):
-        export_sources(repo, commit, exportdir, relative_spec, args)
+        export_sources(repo, commit, exportdir, relative_spec, args,
+                       snapshot=snapshot)
 
     try:
         commit_msg = repo.get_commit_info(args.commit or 'HEAD')['subject']
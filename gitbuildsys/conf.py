@@ -182,6 +182,9 @@ class ConfigMgr(object):
                             'packaging_dir': 'packaging',
                             'work_dir': '.',
                             'fallback_to_native': '',
+                            'reproducible_tarball': '',
+                            'compression_level': '6',
+                            'compression_threads': '1',
                            },
                 'orphan-devel': {'packaging_branch': '',
                                 },
@@ -204,6 +207,10 @@ repos = repo.tizen_latest
 #buildconf = <patch/to/build-config-file>
 #Comma separated list of additional packages be excluded building
 #exclude_packages = libtool,gettext
+#Compression level of generated tarballs, and threads used to compress them,
+#0 means all cpus
+#compression_level = 6
+#compression_threads = 1
 
 
 [obs.tizen]
@@ -297,6 +304,13 @@ url = http://download.tizen.org/releases/daily/trunk/ivi/latest/
         # reload config files
         self.load_confs()
 
+    def remove_conf(self, fpath):
+        """ Remove config added by add_conf from configmgr
+        """
+        if fpath in self._cfgfiles:
+            self._cfgfiles.remove(fpath)
+            self.load_confs()
+
     @staticmethod
     def _lookfor_confs():
         """Look for available config files following the order:
@@ -24,8 +24,14 @@ Only APIs which are required by cmd_remotebuild present here.
 
 import os
 import re
+import base64
+import sys
+import time
+import httplib
 import urllib2
+import threading
 import M2Crypto
+import M2Crypto.threading
 from M2Crypto.SSL.Checker import SSLVerificationError
 import ssl
 
@@ -34,18 +40,134 @@ from urllib import quote_plus, pathname2url
 
 from xml.etree import cElementTree as ET
 
-from gitbuildsys.utils import hexdigest
+from gitbuildsys.utils import get_digest_cache, pool_map
 from gitbuildsys.errors import ObsError
 from gitbuildsys.log import waiting
 from gitbuildsys.log import LOGGER as logger
 
 from osc import conf, core
 
+# Upper limit of files uploaded concurrently by OSC.commit_files
+UPLOAD_THREADS = 4
+# Attempts to upload one file, and seconds to wait before the first retry,
+# doubled for every next one
+UPLOAD_ATTEMPTS = 5
+UPLOAD_BACKOFF = 2
+
+# Size of blocks build log is read and filtered in
+BUILDLOG_CHUNK_SIZE = 64 * 1024
+# Control characters removed from build log, except newline
+BUILDLOG_DELETE_CHARS = ''.join([chr(i) for i in range(10) + range(11, 32)])
+
+# Bounds in seconds of the delay between result polls of OSC.watch_results
+WATCH_MIN_DELAY = 5
+WATCH_MAX_DELAY = 120
+# Seconds OSC.watch_results waits for OBS to schedule the first builds
+WATCH_NO_RESULTS_TIMEOUT = 600
+# Build result codes which don't change without a new commit
+FINAL_RESULTS = ('succeeded', 'failed', 'unresolvable', 'broken',
+                 'disabled', 'excluded')
+
+# osc.core.http_request installs urllib2 opener, sets default socket
+# timeout and saves cookies on every call, none of which is thread safe
+_HTTP_REQUEST_LOCK = threading.Lock()
+
 class OSCError(Exception):
     """Local exception class."""
     pass
 
 
+class UploadProgress(object):
+    """
+    Count bytes sent by concurrent uploads and show the total on a
+    terminal once a second.
+    """
+
+    def __init__(self, total):
+        self.total = total
+        self.sent = 0
+        self.lock = threading.Lock()
+        self.stop = threading.Event()
+        self.thread = None
+
+    def add(self, count):
+        """Account count bytes more sent, negative on restarted upload"""
+        with self.lock:
+            self.sent += count
+
+    def line(self):
+        """Progress line text"""
+        percent = 100 * self.sent / self.total if self.total else 100
+        return 'uploading: %.1f of %.1f MiB (%d%%)' % \
+               (self.sent / 1048576.0, self.total / 1048576.0, percent)
+
+    def _report_loop(self):
+        """Main loop of progress printing thread"""
+        while not self.stop.wait(1):
+            sys.stderr.write('\r%s' % self.line())
+            sys.stderr.flush()
+
+    def start(self):
+        """Start printing, if stderr is a terminal"""
+        if sys.stderr.isatty():
+            self.thread = threading.Thread(target=self._report_loop)
+            self.thread.daemon = True
+            self.thread.start()
+
+    def finish(self):
+        """Stop printing and end progress line"""
+        self.stop.set()
+        if self.thread:
+            self.thread.join()
+            sys.stderr.write('\r%s\n' % self.line())
+
+
+class UploadReader(object):
+    """File object passing the bytes read to UploadProgress"""
+
+    def __init__(self, fpath, progress):
+        self.fobj = open(fpath, 'rb')
+        self.progress = progress
+        self.count = 0
+
+    def read(self, size=-1):
+        """Read like file.read, httplib reads in small blocks"""
+        data = self.fobj.read(size)
+        self.count += len(data)
+        self.progress.add(len(data))
+        return data
+
+    def rewind(self):
+        """Start reading from the beginning, taking bytes back from progress"""
+        self.fobj.seek(0)
+        self.progress.add(-self.count)
+        self.count = 0
+
+    def close(self):
+        """Close file and take its bytes back from progress"""
+        self.fobj.close()
+        self.progress.add(-self.count)
+        self.count = 0
+
+
+class UploadRequest(urllib2.Request):
+    """
+    PUT request of UploadReader. urllib2 sends request again on
+    authentication challenge, so body is rewound each time urllib2
+    prepares it for sending.
+    """
+
+    def __init__(self, url, reader, headers):
+        urllib2.Request.__init__(self, url, data=reader, headers=headers)
+
+    def get_method(self):
+        return 'PUT'
+
+    def get_data(self):
+        self.data.rewind()
+        return self.data
+
+
 class OSC(object):
     """Interface to OSC API"""
 
@@ -254,12 +376,13 @@ class OSC(object):
         # Helper dictionary helps to avoid looping over remote files
         rdict = dict((fobj.name, (fobj.size, fobj.md5)) for fobj in rfiles)
 
+        digests = get_digest_cache()
         for lpath in paths:
             lname = os.path.basename(lpath)
             if lname in rdict:
                 lsize = os.path.getsize(lpath)
                 rsize, rmd5 = rdict[lname]
-                if rsize == lsize and rmd5 == core.dgst(lpath):
+                if rsize == lsize and rmd5 == digests.md5(lpath):
                     not_changed.append(lpath)
                 else:
                     changed.append(lpath)
@@ -268,12 +391,16 @@ class OSC(object):
                 rdict.pop(lname)
             else:
                 new.append(lpath)
+        digests.save()
 
         return rdict.keys(), not_changed, changed, new
 
-    @waiting
     def commit_files(self, prj, pkg, files, message):
-        """Commits files to OBS."""
+        """
+        Commits files to OBS. Only files OBS reports missing are
+        uploaded, so ones already sent by an interrupted commit of
+        the same content are not sent again.
+        """
 
         query = {'cmd'    : 'commitfilelist',
                  'user'   : conf.get_apiurl_usr(self.apiurl),
@@ -281,26 +408,161 @@ class OSC(object):
                  'keeplink': 1}
         url = core.makeurl(self.apiurl, ['source', prj, pkg], query=query)
 
+        digests = get_digest_cache()
         xml = "<directory>"
         for fpath, _ in files:
-            with open(fpath) as fhandle:
-                xml += '<entry name="%s" md5="%s"/>' % \
-                       (os.path.basename(fpath), hexdigest(fhandle))
+            xml += '<entry name="%s" md5="%s"/>' % \
+                   (os.path.basename(fpath), digests.md5(fpath))
         xml += "</directory>"
+        digests.save()
 
         try:
-            self.core_http(core.http_POST, url, data=xml)
-            for fpath, commit_flag in files:
-                if commit_flag:
-                    put_url = core.makeurl(
-                        self.apiurl, ['source', prj, pkg,
-                                      pathname2url(os.path.basename(fpath))],
-                        query="rev=repository")
-                    self.core_http(core.http_PUT, put_url, filep=fpath)
-            self.core_http(core.http_POST, url, data=xml)
+            missing = self.commit_filelist(url, xml)
+            if missing is None:
+                # unknown reply, upload all changed files
+                upload = [fpath for fpath, commit_flag in files
+                          if commit_flag]
+            else:
+                upload = [fpath for fpath, _ in files
+                          if os.path.basename(fpath) in missing]
+            if missing != []:
+                self.put_files(prj, pkg, upload)
+                missing = self.commit_filelist(url, xml)
+                if missing is None:
+                    raise OSCError('unknown reply to commit after upload')
+                if missing:
+                    raise OSCError('files missing after upload: %s' % \
+                                   ', '.join(missing))
         except OSCError, err:
             raise ObsError("can't commit files to %s/%s: %s" % (prj, pkg, err))
 
+    @waiting
+    def commit_filelist(self, url, xml):
+        """
+        Post commitfilelist request. Return names of files OBS doesn't
+        have content of, empty list if commit is done, None if reply
+        can't be parsed. Raises OSCError if OBS reports another error.
+        """
+        reply = self.core_http(core.http_POST, url, data=xml).read()
+        try:
+            root = ET.fromstring(reply)
+        except SyntaxError:
+            return None
+        if root.tag != 'directory':
+            return None
+        error = root.get('error')
+        if error is None:
+            return []
+        if error != 'missing':
+            raise OSCError('commit failed: %s' % error)
+        return [entry.get('name') for entry in root.findall('entry')]
+
+    def upload_opener(self):
+        """
+        Get urllib2 opener osc uses for apiurl, which upload threads share
+        instead of going through core.http_request. It's private to osc,
+        None if osc doesn't provide it.
+        """
+        build_opener = getattr(conf, '_build_opener', None)
+        if build_opener is None:
+            return None
+        with _HTTP_REQUEST_LOCK:
+            return build_opener(self.apiurl)
+
+    def upload_auth(self):
+        """Basic authorization header for apiurl, None if unknown"""
+        try:
+            options = conf.config['api_host_options'][self.apiurl]
+            return 'Basic %s' % base64.b64encode('%s:%s' % (options['user'],
+                                                            options['pass']))
+        except KeyError:
+            return None
+
+    @staticmethod
+    def put_file(url, fpath, progress, opener=None, auth=None):
+        """
+        Stream one file to url in a PUT request, by opener if given, by
+        serialized core.http_request otherwise. OBS can't resume a file,
+        so failed transfer is restarted from the beginning with
+        exponential backoff. Client errors are not retried. Credentials
+        are sent up front, so that file is not sent again on challenge.
+        """
+        delay = UPLOAD_BACKOFF
+        for count in range(1, UPLOAD_ATTEMPTS + 1):
+            reader = UploadReader(fpath, progress)
+            headers = {'Content-Type': 'application/octet-stream',
+                       'Content-Length': str(os.path.getsize(fpath))}
+            if auth:
+                headers['Authorization'] = auth
+            try:
+                if opener:
+                    opener.open(UploadRequest(url, reader, headers)).close()
+                else:
+                    with _HTTP_REQUEST_LOCK:
+                        core.http_request('PUT', url, headers=headers,
+                                          data=reader).close()
+                reader.fobj.close()
+                return
+            except urllib2.HTTPError, err:
+                reader.close()
+                if err.code < 500 and err.code != 408:
+                    raise OSCError(str(err))
+            except (urllib2.URLError, M2Crypto.m2urllib2.URLError,
+                    M2Crypto.SSL.SSLError, ssl.SSLError,
+                    httplib.HTTPException), err:
+                reader.close()
+            if count == UPLOAD_ATTEMPTS:
+                raise OSCError('%s: %s' % (os.path.basename(fpath), err))
+            logger.debug('upload of %s failed: %s, retrying in %d seconds' \
+                         % (os.path.basename(fpath), err, delay))
+            time.sleep(delay)
+            delay *= 2
+
+    def put_files(self, prj, pkg, fpaths, threads=UPLOAD_THREADS):
+        """
+        Upload files to the repository of package concurrently, largest
+        first. Files not started yet are skipped after the first failure,
+        whose OSCError is raised when all uploads in progress have ended.
+        """
+        failures = []
+        lock = threading.Lock()
+
+        if not fpaths:
+            return
+        fpaths = sorted(fpaths, key=os.path.getsize, reverse=True)
+        progress = UploadProgress(sum(os.path.getsize(fpath)
+                                      for fpath in fpaths))
+        opener = self.upload_opener()
+        auth = self.upload_auth()
+        # OpenSSL needs locking callbacks to be used from several threads,
+        # installed once, later calls do nothing
+        M2Crypto.threading.init()
+
+        def put(fpath):
+            """Upload one file, unless another upload has failed"""
+            if failures:
+                return
+            put_url = core.makeurl(self.apiurl,
+                                   ['source', prj, pkg,
+                                    pathname2url(os.path.basename(fpath))],
+                                   query="rev=repository")
+            try:
+                self.put_file(put_url, fpath, progress, opener, auth)
+            except OSCError, err:
+                with lock:
+                    failures.append(err)
+
+        progress.start()
+        try:
+            pool_map(put, fpaths, min(threads, len(fpaths)), threads=True)
+        finally:
+            progress.finish()
+            # what core.http_request does after each request
+            if opener and hasattr(getattr(conf, 'cookiejar', None), 'save'):
+                conf.cookiejar.save(ignore_discard=True)
+        if failures:
+            raise failures[0]
+
     def create_package(self, prj, pkg):
         """Create package in the project."""
 
@@ -337,18 +599,93 @@ class OSC(object):
 
         return results
 
+    def iter_buildlog(self, prj, pkg, repo, arch, follow=False):
+        """
+        Generate package build log from OBS in filtered chunks. With
+        follow log is streamed while building and requested again from
+        the last offset, until OBS has no new data.
+        """
+        offset = 0
+        while True:
+            query = 'start=%d' % offset
+            if not follow:
+                query = 'nostream=1&' + query
+            url = core.makeurl(self.apiurl, ['build', prj, repo, arch, pkg,
+                                             '_log?%s' % query])
+            start = offset
+            try:
+                reply = self.core_http(core.http_GET, url)
+                while True:
+                    chunk = reply.read(BUILDLOG_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    offset += len(chunk)
+                    yield chunk.translate(None, BUILDLOG_DELETE_CHARS)
+            except (OSCError, urllib2.URLError, M2Crypto.SSL.SSLError,
+                    ssl.SSLError, httplib.HTTPException), err:
+                raise ObsError("can't get %s/%s build log: %s" % \
+                               (prj, pkg, err))
+            if not follow or offset == start:
+                break
+
+    def watch_results(self, prj, pkg):
+        """
+        Generate package build results, in the form returned by
+        get_results, each time they change until all of them are final.
+        OBS holds the request until results differ from oldstate. If it
+        doesn't, polls are made with growing delay while nothing changes.
+        Having no results right after commit isn't final, they are waited
+        for up to WATCH_NO_RESULTS_TIMEOUT.
+        """
+        oldstate = None
+        last = None
+        delay = WATCH_MIN_DELAY
+        deadline = time.time() + WATCH_NO_RESULTS_TIMEOUT
+        while True:
+            query = {'package': pkg}
+            if oldstate:
+                query['oldstate'] = oldstate
+            url = core.makeurl(self.apiurl, ['build', prj, '_result'],
+                               query=query)
+            started = time.time()
+            try:
+                root = ET.fromstring(self.core_http(core.http_GET,
+                                                    url).read())
+            except OSCError, err:
+                raise ObsError("can't get %s/%s build results: %s" \
+                               % (prj, pkg, err))
+            except SyntaxError, err:
+                raise ObsError("invalid build results of %s/%s: %s" \
+                               % (prj, pkg, err))
+            oldstate = root.get('state')
+
+            results = defaultdict(dict)
+            final = True
+            for result in root.findall('result'):
+                status = result.find('status')
+                code = status.get('code') if status is not None else \
+                       result.get('code')
+                results[result.get('repository')][result.get('arch')] = code
+                if code not in FINAL_RESULTS or result.get('dirty'):
+                    final = False
+            if not results and time.time() < deadline:
+                final = False
+
+            if results != last:
+                yield results
+                last = results
+                delay = WATCH_MIN_DELAY
+            else:
+                elapsed = time.time() - started
+                if elapsed < delay:
+                    time.sleep(delay - elapsed)
+                delay = min(delay * 2, WATCH_MAX_DELAY)
+            if final:
+                break
+
     def get_buildlog(self, prj, pkg, repo, arch):
         """Get package build log from OBS."""
-
-        url = core.makeurl(self.apiurl, ['build', prj, repo, arch, pkg,
-                                         '_log?nostream=1&start=0'])
-        try:
-            log = self.core_http(core.http_GET, url).read()
-        except OSCError, err:
-            raise ObsError("can't get %s/%s build log: %s" % (prj, pkg, err))
-
-        return log.translate(None, "".join([chr(i) for i in \
-                                                    range(10) + range(11, 32)]))
+        return ''.join(self.iter_buildlog(prj, pkg, repo, arch))
 
     @staticmethod
     def get_path(prj, pkg=None):
@@ -20,25 +20,90 @@
 
 import os
 import re
+import sys
+import pwd
+import bz2
 import gzip
 import glob
+import tarfile
 import tempfile
 import shutil
+import json
+import time
 import pycurl
 import hashlib
 import fnmatch
 import signal
 import subprocess
+import multiprocessing
+from multiprocessing.pool import ThreadPool
 import argparse
 import xml.etree.ElementTree as ET
-from collections import defaultdict
+from collections import defaultdict, OrderedDict, namedtuple
 
 from gitbuildsys.errors import UrlError, GbsError
 from gitbuildsys.log import LOGGER as log
 
 from gbp.rpm.git import RpmGitRepository, GitRepositoryError
 from gbp.errors import GbpError
-
+import gbp.rpm
+
+# Upper limit of the persistent cache of remote repo metadata
+HTTP_CACHE_MAX_SIZE = 64 * 1024 * 1024
+
+_URLGRABBER = None
+
+# local configs read from git revisions, see read_localconf_from_rev()
+_LOCALCONF_TEMPS = []
+# paths of local configs of projects added to configmgr
+_LOCALCONFS = []
+
+# Upper limit of repos to keep git cat-file processes running for
+GIT_READERS_MAX = 16
+_GIT_READERS = OrderedDict()
+# (repo, tree sha1) => paths in tree, see list_packaging_dir_in_rev()
+_REV_TREES = {}
+
+# Upper limit of entries of the persistent cache of spec header fields
+SPEC_CACHE_MAX_ENTRIES = 20000
+# Bumped when SpecHeaderParser results change, to drop wrong entries
+SPEC_CACHE_VERSION = 2
+_SPEC_CACHE = None
+
+# rpm macro files which can change results of spec parsing
+RPM_MACRO_FILES = ['/usr/lib/rpm/macros', '/usr/lib/rpm/macros.d/*',
+                   '/usr/lib/rpm/*/macros', '/etc/rpm/macros*',
+                   '/etc/rpm/macros.d/*', '~/.rpmmacros']
+_RPM_MACROS_FINGERPRINT = None
+
+SpecInfo = namedtuple('SpecInfo', 'name version upstreamversion release')
+GitStatus = namedtuple('GitStatus', 'uncommitted untracked')
+
+# Upper limit of entries of the persistent cache of patches of commits
+PATCH_CACHE_MAX_ENTRIES = 50000
+
+# Read size of files to hash, and upper limit of entries of the persistent
+# cache of their digests
+DIGEST_BLOCK_SIZE = 1024 * 1024
+DIGEST_CACHE_MAX_ENTRIES = 10000
+_DIGEST_CACHE = None
+
+# parallel drop-in replacements of compressors, with their threads option
+PARALLEL_COMPRESSORS = {'gzip': [('pigz', '-p %d')],
+                        'bzip2': [('lbzip2', '-n %d'), ('pbzip2', '-p%d')]}
+
+# Upper limit of the persistent cache of exported packaging files
+EXPORT_CACHE_MAX_SIZE = 2 * 1024 * 1024 * 1024
+# cached files of at least this size are hardlinked instead of copied
+EXPORT_CACHE_LINK_SIZE = 1024 * 1024
+
+# compressions of tarballs by name suffix, see normalize_tarball(). xz and
+# zstd are run as programs, python has no modules for them
+TARBALL_COMPRESSIONS = [(('.tar.gz', '.tgz'), 'gz'),
+                        (('.tar.bz2', '.tbz2', '.tbz'), 'bz2'),
+                        (('.tar.xz', '.txz'), 'xz'),
+                        (('.tar.zst',), 'zstd'),
+                        (('.tar',), '')]
 
 class Workdir(object):
     """
@@ -59,6 +124,84 @@ class Workdir(object):
     def __exit__(self, _type, _value, _tb):
         os.chdir(self._cwd)
 
+class CompressionThreads(object):
+    """
+    Context manager, which makes compressors run by gbp use given number
+    of threads, 0 meaning all cpus. gzip and bzip2 are replaced by their
+    parallel implementations through a PATH shim if those are installed,
+    xz and zstd get threads from environment. Output formats don't change.
+    Usage example:
+        with utils.CompressionThreads(4):
+            # run gbp here
+    """
+    def __init__(self, threads):
+        self.threads = threads or multiprocessing.cpu_count()
+        self._shimdir = None
+        self._environ = {}
+
+    def _setenv(self, name, value):
+        """Set environment variable, remembering the original value."""
+        self._environ.setdefault(name, os.environ.get(name))
+        os.environ[name] = value
+
+    def __enter__(self):
+        if self.threads == 1:
+            return
+        self._shimdir = Temp(prefix='gbs_compress_', directory=True)
+        for name, parallels in PARALLEL_COMPRESSORS.iteritems():
+            for binary, threads_opt in parallels:
+                path = find_binary_path(binary)
+                if path:
+                    shim = os.path.join(self._shimdir.path, name)
+                    with open(shim, 'w') as fobj:
+                        fobj.write('#!/bin/sh\nexec %s %s "$@"\n' %
+                                   (path, threads_opt % self.threads))
+                    os.chmod(shim, 0755)
+                    break
+        self._setenv('PATH', '%s:%s' % (self._shimdir.path,
+                                        os.environ.get('PATH', '')))
+        self._setenv('XZ_DEFAULTS', '-T%d' % self.threads)
+        self._setenv('ZSTD_NBTHREADS', str(self.threads))
+
+    def __exit__(self, _type, _value, _tb):
+        for name, value in self._environ.iteritems():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+        self._environ = {}
+        self._shimdir = None
+
+def find_binary_path(binary):
+    """Find binary in PATH, None if not found."""
+    for path in os.environ.get('PATH', '').split(os.pathsep):
+        bin_path = os.path.join(path, binary)
+        if os.path.isfile(bin_path) and os.access(bin_path, os.X_OK):
+            return bin_path
+    return None
+
+def list_packaging_dir_in_rev(git_path, packaging_dir, commit_id):
+    """
+    List packaging dir in given revision recursively, following it if it's
+    a symlink. Listings are memoized by tree sha1 for the process lifetime,
+    so all spec lookups of the same revision are answered from one listing.
+    Returns: tuple of real packaging dir and list of paths under it.
+    """
+    reader = get_git_reader(git_path)
+    obj = reader.stat(commit_id, packaging_dir)
+    if obj and obj[1] == 'blob':
+        # packaging_dir is a symlink
+        packaging_dir = reader.show(commit_id, packaging_dir)
+        obj = reader.stat(commit_id, packaging_dir)
+    if not obj or obj[1] != 'tree':
+        return packaging_dir, []
+
+    key = (reader.git_path, obj[0])
+    if key not in _REV_TREES:
+        _REV_TREES[key] = [path for _mode, path in reader.walk(obj[0])]
+    return packaging_dir, [os.path.join(packaging_dir, path)
+                           for path in _REV_TREES[key]]
+
 def guess_spec(git_path, packaging_dir, given_spec, commit_id='WC.UNTRACKED'):
     """Guess spec file from project name if not given."""
     git_path = os.path.abspath(git_path)
@@ -72,22 +215,14 @@ def guess_spec(git_path, packaging_dir, given_spec, commit_id='WC.UNTRACKED'):
             for name in reversed(glob.glob(os.path.join(git_path, pattern)))]
         msg = 'No such spec file %s'
     else:
-        git_object = commit_id + ':' + packaging_dir
-        cmd = ['git', 'show', git_object]
-        try:
-            with Workdir(git_path):
-                outp = subprocess.Popen(cmd, stdout=subprocess.PIPE)
-        except (subprocess.CalledProcessError, OSError):
-            raise GbsError("failed to run %s in %s" % (' '.join(cmd), git_path))
-        output = outp.communicate()[0]
-        if not output.startswith('tree %s' % git_object):
-            # packaging_dir is a symlink
-            packaging_dir = output
-        check = lambda fname, dir_only=False: file_exists_in_rev(git_path,
-                                                                 fname,
-                                                                 commit_id, \
-                                                              dir_only=dir_only)
-        glob_ = lambda pattern: glob_in_rev(git_path, pattern, commit_id)
+        packaging_dir, files = list_packaging_dir_in_rev(git_path,
+                                                         packaging_dir,
+                                                         commit_id)
+        check = lambda fname, dir_only=False: fname in files
+        glob_ = lambda pattern: [name for name in fnmatch.filter(files,
+                                                                 pattern)
+                                 if os.path.dirname(name) == \
+                                    os.path.dirname(pattern)]
         msg = "No such spec file %%s in %s" % commit_id
 
     spec = None
@@ -102,6 +237,9 @@ def guess_spec(git_path, packaging_dir, given_spec, commit_id='WC.UNTRACKED'):
                        "%s" % packaging_dir)
 
     project_name = os.path.basename(git_path)
+    if project_name.endswith('.git'):
+        # bare repository or mirror
+        project_name = project_name[:-len('.git')]
     if not spec:
         spec = os.path.join(packaging_dir, '%s.spec' % project_name)
         spec = spec if spec in specs else specs[0]
@@ -185,39 +323,150 @@ class TempCopy(object):
 class PageNotFound(Exception):
     """Custom exception to handle HTTP 404 error."""
 
+def _setopt_if_supported(obj, option, value):
+    '''
+    Set option of Curl/CurlMulti/CurlShare object, given by names of pycurl
+    constants, if both pycurl and libcurl support it.
+    '''
+    if not hasattr(pycurl, option):
+        return False
+    if isinstance(value, basestring):
+        if not hasattr(pycurl, value):
+            return False
+        value = getattr(pycurl, value)
+    try:
+        obj.setopt(getattr(pycurl, option), value)
+    except pycurl.error:
+        return False
+    return True
+
+
 class URLGrabber(object):
-    '''grab an url and save to local file'''
+    '''
+    grab an url and save to local file
+
+    All Curl objects of the process share DNS cache, TLS sessions and
+    connections through one CurlShare object. Curl objects are pooled and
+    kept alive between transfers, so following requests to the same host
+    reuse warm connections, multiplexed over HTTP/2 if server supports it.
+    '''
+
+    # default limit of simultaneous transfers of grab_many()
+    max_connections = 8
+
+    _share = None
 
     def __init__(self, connect_timeout=30):
         '''create Curl object and set one-time options'''
+        self.connect_timeout = connect_timeout
+        self.curl = self._new_curl()
+        self._idle = []
+        self._multi = None
+
+    @classmethod
+    def _get_share(cls):
+        '''return CurlShare object shared by all Curl objects'''
+        if cls._share is None:
+            share = pycurl.CurlShare()
+            for data in ('LOCK_DATA_DNS', 'LOCK_DATA_SSL_SESSION',
+                         'LOCK_DATA_CONNECT'):
+                _setopt_if_supported(share, 'SH_SHARE', data)
+            cls._share = share
+        return cls._share
+
+    def _new_curl(self):
+        '''create Curl object with one-time options set'''
         curl = pycurl.Curl()
         curl.setopt(pycurl.FAILONERROR, True)
         curl.setopt(pycurl.FOLLOWLOCATION, True)
         curl.setopt(pycurl.SSL_VERIFYPEER, False)
         curl.setopt(pycurl.SSL_VERIFYHOST, False)
-        curl.setopt(pycurl.CONNECTTIMEOUT, connect_timeout)
+        curl.setopt(pycurl.CONNECTTIMEOUT, self.connect_timeout)
+        curl.setopt(pycurl.SHARE, self._get_share())
+        _setopt_if_supported(curl, 'TCP_KEEPALIVE', 1)
+        _setopt_if_supported(curl, 'HTTP_VERSION', 'CURL_HTTP_VERSION_2TLS')
+        # wait for multiplexing on existing HTTP/2 connection
+        _setopt_if_supported(curl, 'PIPEWAIT', 1)
         #curl.setopt(pycurl.VERBOSE, 1)
-        self.curl = curl
-
-    def change_url(self, url, outfile, user, passwd, no_cache=False):
+        return curl
+
+    def _get_multi(self, max_connections):
+        '''return CurlMulti object kept for the life of the grabber'''
+        if self._multi is None:
+            self._multi = pycurl.CurlMulti()
+            _setopt_if_supported(self._multi, 'M_PIPELINING',
+                                 'PIPE_MULTIPLEX')
+        self._multi.setopt(pycurl.M_MAXCONNECTS, max_connections)
+        _setopt_if_supported(self._multi, 'M_MAX_TOTAL_CONNECTIONS',
+                             max_connections)
+        return self._multi
+
+    def change_url(self, url, outfile, user, passwd, no_cache=False,
+                   headers=None):
         '''change options for individual url'''
+        self._setup_curl(self.curl, url, outfile, user, passwd, no_cache,
+                         headers)
 
-        curl = self.curl
+    def _setup_curl(self, curl, url, outfile, user, passwd, no_cache=False,
+                    headers=None):
+        '''set options for individual url on given Curl object'''
         curl.url = url
+        curl.headers = {}
         curl.setopt(pycurl.URL, url)
         curl.setopt(pycurl.WRITEDATA, outfile)
+        curl.setopt(pycurl.HEADERFUNCTION,
+                    lambda line: self._store_header(curl, line))
         if user:
             userpwd = user
             if passwd:
                 userpwd = '%s:%s' % (user, passwd)
             curl.setopt(pycurl.USERPWD, userpwd)
-        httpheader = []
+        else:
+            # Curl objects are reused, don't leak credentials of last url
+            curl.unsetopt(pycurl.USERPWD)
+        httpheader = list(headers or [])
         if no_cache:
             httpheader.append('Pragma: no-cache')
             httpheader.append('Cache-Control: no-cache')
             log.debug("disable HTTP caching")
         curl.setopt(pycurl.HTTPHEADER, httpheader)
 
+    @staticmethod
+    def _store_header(curl, line):
+        '''collect response headers of the last response into curl.headers'''
+        if line.startswith('HTTP/'):
+            # new response, e.g. after redirection
+            curl.headers = {}
+        elif ':' in line:
+            name, value = line.split(':', 1)
+            curl.headers[name.strip().lower()] = value.strip()
+
+    @staticmethod
+    def _error(curl, errcode, errmsg):
+        '''translate failure of Curl object into exception to be raised'''
+        log.debug('fetching error:%s: %s' % (errcode, errmsg))
+        http_code = curl.getinfo(pycurl.HTTP_CODE)
+
+        if errcode == pycurl.E_OPERATION_TIMEOUTED or http_code == 503:
+            proxies = ['Detected proxies set in system environment:']
+            env = os.environ
+            for key in ['HTTPS_PROXY', 'HTTP_PROXY', 'FTP_PROXY',
+                        'https_proxy', 'http_proxy', 'ftp_proxy',
+                        'NO_PROXY', 'no_proxy']:
+                proxies.append('%s=%s' % (key, env.get(key, '')))
+            return UrlError("connect timeout to %s, maybe it's caused by "
+                            "proxy settings, please check. %s" % (curl.url, \
+                            '\n  '.join(proxies)))
+        elif errcode == pycurl.E_ABORTED_BY_CALLBACK:
+            return KeyboardInterrupt(errmsg)
+        elif http_code in (401, 403):
+            return UrlError('authenticate failed on: %s' % curl.url)
+        elif http_code == 404:
+            return PageNotFound(errmsg)
+        else:
+            return UrlError('URL error on %s: (%s: "%s")' %
+                            (curl.url, errcode, errmsg))
+
     def perform(self):
         '''do the real Curl perform work'''
 
@@ -240,57 +489,311 @@ class URLGrabber(object):
         try:
             curl.perform()
         except pycurl.error, err:
-            log.debug('fetching error:%s' % str(err))
-
             errcode, errmsg = err.args
-            http_code = curl.getinfo(pycurl.HTTP_CODE)
-
-            if errcode == pycurl.E_OPERATION_TIMEOUTED or http_code == 503:
-                proxies = ['Detected proxies set in system environment:']
-                env = os.environ
-                for key in ['HTTPS_PROXY', 'HTTP_PROXY', 'FTP_PROXY',
-                            'https_proxy', 'http_proxy', 'ftp_proxy',
-                            'NO_PROXY', 'no_proxy']:
-                    proxies.append('%s=%s' % (key, env.get(key, '')))
-                raise UrlError("connect timeout to %s, maybe it's caused by "
-                               "proxy settings, please check. %s" % (curl.url, \
-                               '\n  '.join(proxies)))
-            elif errcode == pycurl.E_ABORTED_BY_CALLBACK:
-                raise KeyboardInterrupt(err)
-            elif http_code in (401, 403):
-                raise UrlError('authenticate failed on: %s' % curl.url)
-            elif http_code == 404:
-                raise PageNotFound(err)
-            else:
-                raise UrlError('URL error on %s: (%s: "%s")' %
-                               (curl.url, errcode, errmsg))
+            raise self._error(curl, errcode, errmsg)
         finally:
             signal.signal(signal.SIGINT, original_handler)
 
     def __del__(self):
-        """Close curl object."""
-        self.curl.close()
+        """Close curl objects."""
+        for curl in [self.curl] + self._idle:
+            curl.close()
         self.curl = None
+        self._idle = []
+        if self._multi is not None:
+            self._multi.close()
+            self._multi = None
 
-    def grab(self, url, filename, user=None, passwd=None, no_cache=False):
-        """Grab url to file."""
+    def grab(self, url, filename, user=None, passwd=None, no_cache=False,
+             headers=None):
+        """
+        Grab url to file.
+        Returns: tuple of HTTP code and dictionary of response headers.
+        """
 
         log.debug("fetching %s => %s" % (url, filename))
 
         with open(filename, 'w') as outfile:
-            self.change_url(url, outfile, user, passwd, no_cache)
+            self.change_url(url, outfile, user, passwd, no_cache, headers)
             self.perform()
 
+        return self.curl.getinfo(pycurl.HTTP_CODE), self.curl.headers
+
+    def grab_many(self, requests, max_connections=None):
+        """
+        Grab many urls concurrently, at most max_connections at a time.
+        requests is a list of tuples:
+            (url, filename, user, passwd, no_cache, headers)
+        Returns: list of results in the same order as requests, each
+        result is either tuple of HTTP code and dictionary of response
+        headers, or the exception instance grab() would have raised.
+        """
+        results = [None] * len(requests)
+        if not requests:
+            return results
+
+        max_connections = max_connections or self.max_connections
+        multi = self._get_multi(max_connections)
+        free = []
+        for _ in range(min(max_connections, len(requests))):
+            free.append(self._idle.pop() if self._idle else self._new_curl())
+        handles = free[:]
+        pending = list(reversed(list(enumerate(requests))))
+        active = []
+
+        stop = [False]
+        def handler(_signum, _frame):
+            '''set stop flag if catch SIGINT'''
+            stop[0] = True
+
+        def finish(curl, result):
+            '''store result of finished transfer and recycle Curl object'''
+            results[curl.index] = result
+            curl.outfile.close()
+            multi.remove_handle(curl)
+            active.remove(curl)
+            free.append(curl)
+
+        original_handler = signal.signal(signal.SIGINT, handler)
+        try:
+            while pending or active:
+                while pending and free:
+                    index, (url, filename, user, passwd, no_cache,
+                            headers) = pending.pop()
+                    log.debug("fetching %s => %s" % (url, filename))
+                    curl = free.pop()
+                    curl.index = index
+                    curl.outfile = open(filename, 'w')
+                    self._setup_curl(curl, url, curl.outfile, user, passwd,
+                                     no_cache, headers)
+                    multi.add_handle(curl)
+                    active.append(curl)
+
+                while True:
+                    ret, _running = multi.perform()
+                    if ret != pycurl.E_CALL_MULTI_PERFORM:
+                        break
+
+                while True:
+                    queued, succeeded, failed = multi.info_read()
+                    for curl in succeeded:
+                        finish(curl, (curl.getinfo(pycurl.HTTP_CODE),
+                                      curl.headers))
+                    for curl, errcode, errmsg in failed:
+                        finish(curl, self._error(curl, errcode, errmsg))
+                    if not queued:
+                        break
+
+                if stop[0]:
+                    raise KeyboardInterrupt('fetching aborted')
+                if active:
+                    multi.select(1.0)
+        finally:
+            signal.signal(signal.SIGINT, original_handler)
+            for curl in active:
+                curl.outfile.close()
+                multi.remove_handle(curl)
+            # keep Curl objects alive for next transfers
+            self._idle.extend(handles)
+
+        return results
+
+
+def get_urlgrabber():
+    """Return URLGrabber shared by the whole process."""
+    global _URLGRABBER
+    if _URLGRABBER is None:
+        _URLGRABBER = URLGrabber()
+    return _URLGRABBER
+
+
+class HttpCache(object):
+    """
+    Persistent on-disk cache of remote repository metadata.
+
+    Entries are keyed by the full URL and keep ETag/Last-Modified of the
+    response, so a later fetch only sends a conditional request and costs
+    a 304 if nothing changed. Every URL is revalidated at most once per
+    process. The total size of the cache is bounded by max_size, least
+    recently used entries are evicted first.
+    """
+
+    def __init__(self, cachedir, max_size=HTTP_CACHE_MAX_SIZE):
+        self.cachedir = cachedir
+        self.max_size = max_size
+        # urls revalidated by this process, also protected from eviction
+        self._validated = set()
+
+        if not os.path.exists(cachedir):
+            try:
+                os.makedirs(cachedir)
+            except OSError, err:
+                raise GbsError('failed to create cache dir %s: %s' %
+                               (cachedir, str(err)))
+
+    def _paths(self, url):
+        '''return data and meta file path of the cache entry of url'''
+        base = os.path.join(self.cachedir, hashlib.sha1(url).hexdigest())
+        return base, base + '.meta'
+
+    @staticmethod
+    def _load_meta(meta):
+        '''load meta info of an entry, empty dict if it is unusable'''
+        try:
+            with open(meta) as fobj:
+                return json.load(fobj)
+        except (IOError, ValueError):
+            return {}
+
+    def _remove(self, url):
+        '''drop the cache entry of url'''
+        for path in self._paths(url):
+            if os.path.exists(path):
+                os.unlink(path)
+
+    def _validators(self, url):
+        '''return meta info of cached url and conditional request headers'''
+        data, meta = self._paths(url)
+        info = self._load_meta(meta) if os.path.exists(data) else {}
+        headers = []
+        if info.get('etag'):
+            headers.append('If-None-Match: %s' % info['etag'])
+        if info.get('last_modified'):
+            headers.append('If-Modified-Since: %s' % info['last_modified'])
+        return info, headers
+
+    def _partial(self):
+        '''create temporary file to download into'''
+        fds, partial = tempfile.mkstemp(prefix='.part', dir=self.cachedir)
+        os.close(fds)
+        return partial
+
+    def fetch(self, grabber, url, user=None, passwd=None, no_cache=False):
+        """
+        Fetch url through the cache using given URLGrabber.
+        Returns: path of cached file. Raises PageNotFound like the grabber.
+        """
+        data = self._paths(url)[0]
+        if url in self._validated and os.path.exists(data):
+            os.utime(data, None)
+            return data
+
+        info, headers = self._validators(url)
+        partial = self._partial()
+        try:
+            http_code, resp = grabber.grab(url, partial, user, passwd,
+                                           no_cache, headers)
+            self.update(url, partial, http_code, resp, info)
+        except PageNotFound:
+            self._remove(url)
+            raise
+        finally:
+            if os.path.exists(partial):
+                os.unlink(partial)
+        self.evict()
+
+        return data
+
+    def fetch_many(self, grabber, requests):
+        """
+        Fetch many urls through the cache concurrently, see
+        URLGrabber.grab_many(). requests is a list of tuples:
+            (url, user, passwd, no_cache)
+        Returns: list of paths of cached files or exception instances, in
+        the same order as requests.
+        """
+        results = [None] * len(requests)
+        transfers = []
+        for index, (url, user, passwd, no_cache) in enumerate(requests):
+            data = self._paths(url)[0]
+            if url in self._validated and os.path.exists(data):
+                os.utime(data, None)
+                results[index] = data
+                continue
+            info, headers = self._validators(url)
+            partial = self._partial()
+            transfers.append((index, url, partial, info,
+                              (url, partial, user, passwd, no_cache,
+                               headers)))
+
+        try:
+            grabbed = grabber.grab_many([item[-1] for item in transfers])
+            for (index, url, partial, info, _), result in zip(transfers,
+                                                              grabbed):
+                if isinstance(result, tuple):
+                    self.update(url, partial, result[0], result[1], info)
+                    results[index] = self._paths(url)[0]
+                else:
+                    if isinstance(result, PageNotFound):
+                        self._remove(url)
+                    results[index] = result
+        finally:
+            for _, _, partial, _, _ in transfers:
+                if os.path.exists(partial):
+                    os.unlink(partial)
+        self.evict()
+
+        return results
+
+    def update(self, url, partial, http_code, resp, info):
+        """
+        Update cache entry of url from a finished transfer into partial.
+        info is the meta info which was used for revalidation.
+        """
+        data, meta = self._paths(url)
+        if http_code == 304 and info:
+            log.debug('not modified, using cached %s' % url)
+            os.unlink(partial)
+            os.utime(data, None)
+        else:
+            os.rename(partial, data)
+            tmp_meta = meta + '.part'
+            with open(tmp_meta, 'w') as fobj:
+                json.dump({'url': url,
+                           'etag': resp.get('etag'),
+                           'last_modified': resp.get('last-modified')}, fobj)
+            os.rename(tmp_meta, meta)
+        self._validated.add(url)
+
+    def evict(self):
+        """Remove least recently used entries until cache fits max_size."""
+        protected = set(self._paths(url)[0] for url in self._validated)
+        entries = []
+        total = 0
+        for name in os.listdir(self.cachedir):
+            path = os.path.join(self.cachedir, name)
+            if name.startswith('.') or name.endswith('.meta'):
+                continue
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            total += stat.st_size
+            if path not in protected:
+                entries.append((stat.st_mtime, stat.st_size, path))
+
+        for _mtime, size, path in sorted(entries):
+            if total <= self.max_size:
+                break
+            log.debug('evicting %s from http cache' % path)
+            for fname in (path, path + '.meta'):
+                if os.path.exists(fname):
+                    os.unlink(fname)
+            total -= size
+
 
 class RepoParser(object):
     """Repository parser for generate real repourl and build config."""
 
-    def __init__(self, repos, cachedir):
+    def __init__(self, repos, cachedir, httpcache=None):
         self.cachedir = cachedir
+        self.httpcache = httpcache
         self.repourls = defaultdict(list)
         self.buildconf = None
         self.standardrepos = []
-        self.urlgrabber = URLGrabber()
+        self.urlgrabber = get_urlgrabber()
+        # url => fetched file name, None if page not found
+        self._fetched = {}
 
         self.localrepos, remotes = self.split_out_local_repo(repos)
         self.parse(remotes)
@@ -348,6 +851,9 @@ class RepoParser(object):
         archs = meta.get('archs', [])
         repos = meta.get('repos', [])
 
+        self.prefetch([(baseurl.pathjoin('repos/%s/%s/packages/repodata/'
+                                         'repomd.xml' % (repo, arch)), True)
+                       for arch in archs for repo in repos])
         for arch in archs:
             for repo in repos:
                 repourl = baseurl.pathjoin('repos/%s/%s/packages' % (repo,
@@ -355,20 +861,71 @@ class RepoParser(object):
                 if self.is_standard_repo(repourl):
                     self.repourls[arch].append(repourl)
 
+    def _local_name(self, url):
+        '''file name in cachedir to save url to'''
+        # same basename is used by many repos, e.g. repomd.xml
+        return os.path.join(self.cachedir, '%s-%s' % (
+            hashlib.sha1(url).hexdigest()[:8], os.path.basename(url)))
+
     def fetch(self, url, no_cache=False):
         """
         Fetch url.
         Returns: file name if fetch succeds, else None.
         """
-        fname = os.path.join(self.cachedir, os.path.basename(url))
+        if url in self._fetched:
+            return self._fetched[url]
 
         try:
-            self.urlgrabber.grab(url, fname, url.user, url.passwd, no_cache)
+            if self.httpcache:
+                fname = self.httpcache.fetch(self.urlgrabber, url, url.user,
+                                             url.passwd, no_cache)
+            else:
+                fname = self._local_name(url)
+                self.urlgrabber.grab(url, fname, url.user, url.passwd,
+                                     no_cache)
         except PageNotFound:
-            return
+            fname = None
 
+        self._fetched[url] = fname
         return fname
 
+    def prefetch(self, requests):
+        """
+        Fetch urls concurrently, so that later fetch() of them is served
+        from what has been fetched here.
+        requests is a list of tuples (url, no_cache).
+        Failures other than page not found are not recorded, following
+        fetch() of such url will retry and raise the error.
+        """
+        todo = []
+        for url, no_cache in requests:
+            if url not in self._fetched and url not in [i[0] for i in todo]:
+                todo.append((url, no_cache))
+        if not todo:
+            return
+
+        if self.httpcache:
+            results = self.httpcache.fetch_many(
+                self.urlgrabber,
+                [(url, url.user, url.passwd, no_cache)
+                 for url, no_cache in todo])
+        else:
+            results = self.urlgrabber.grab_many(
+                [(url, self._local_name(url), url.user, url.passwd, no_cache,
+                  None) for url, no_cache in todo])
+            results = [self._local_name(url) if isinstance(res, tuple)
+                       else res for (url, _), res in zip(todo, results)]
+
+        for (url, _), result in zip(todo, results):
+            if isinstance(result, KeyboardInterrupt):
+                raise result
+            if isinstance(result, PageNotFound):
+                self._fetched[url] = None
+            elif isinstance(result, basestring):
+                self._fetched[url] = result
+            else:
+                log.debug('prefetching %s failed: %s' % (url, result))
+
     def is_standard_repo(self, repo):
         """Check if repo is standard repo with repodata/repomd.xml exist."""
 
@@ -400,13 +957,13 @@ class RepoParser(object):
         if fname:
             release, _buildid = meta['id'].split('_')
             release = release.replace('-', '')
-            target_conf = os.path.join(os.path.dirname(fname),
-                                       '%s.conf' % release)
-            os.rename(fname, target_conf)
+            target_conf = os.path.join(self.cachedir, '%s.conf' % release)
+            # fname may be an entry of the http cache, so don't move it
+            shutil.copy(fname, target_conf)
             self.buildconf = target_conf
 
-    def _fetch_build_conf_new(self, baseurl):
-        """ fetch build conf from standard repo"""
+    def _build_conf_url(self, baseurl):
+        """Get url of build conf from repomd.xml of standard repo."""
         repomd_url = baseurl.pathjoin('repodata/repomd.xml')
         repomd_file = self.fetch(repomd_url)
         if not repomd_file:
@@ -427,15 +984,20 @@ class RepoParser(object):
                 location_elem = elem.find('%slocation' % xmlns)
                 break
         if location_elem is not None and 'href' in location_elem.attrib:
-            buildconf_url = baseurl.pathjoin(location_elem.attrib['href'])
+            return baseurl.pathjoin(location_elem.attrib['href'])
+
+    def _fetch_build_conf_new(self, baseurl):
+        """ fetch build conf from standard repo"""
+        buildconf_url = self._build_conf_url(baseurl)
+        if buildconf_url:
             fname = self.fetch(buildconf_url)
             if fname:
-                if fname[-3:] == '.gz':
+                # cached files are not named after url, so check the url
+                if buildconf_url.endswith('.gz'):
                     fh_gz = gzip.open(fname, 'r')
                 else:
                     fh_gz = open(fname, 'r')
-                buildconf_file = os.path.join(os.path.dirname(fname),
-                                              'build.conf')
+                buildconf_file = os.path.join(self.cachedir, 'build.conf')
                 buildconf_fh = open(buildconf_file, 'w')
                 buildconf_fh.write(fh_gz.read())
                 fh_gz.close()
@@ -474,6 +1036,17 @@ class RepoParser(object):
                                    'and please specify real RPM repo with '\
                                    'repodata under it.')
 
+        # Probe all remotes at once, and then all build confs referred by
+        # standard repos. deal_with_one_repo() is served from prefetched
+        # files, so order of repos stays the same as given.
+        self.prefetch([(repo.pathjoin('repodata/repomd.xml'), True)
+                       for repo in remotes] +
+                      [(repo.pathjoin('builddata/build.xml'), False)
+                       for repo in remotes])
+        self.prefetch([(url, False) for url in
+                       [self._build_conf_url(repo) for repo in remotes
+                        if self.is_standard_repo(repo)] if url])
+
         for repo in remotes:
             deal_with_one_repo(repo)
 
@@ -524,6 +1097,33 @@ def read_localconf(workdir):
     prj_conf = os.path.join(workdir, '.gbs.conf')
     if os.path.exists(prj_conf) and workdir != os.getcwd():
         configmgr.add_conf(prj_conf)
+        _LOCALCONFS.append(prj_conf)
+
+
+def read_localconf_from_rev(git_path, commit_id):
+    """
+    Read local configuration file from given revision, for repositories
+    without working tree.
+    """
+    from gitbuildsys.conf import configmgr
+    content = show_file_from_rev(git_path, '.gbs.conf', commit_id)
+    if content is not None:
+        tmp_conf = Temp(prefix='gbs_localconf_', content=content)
+        # configs are reloaded from files whenever another one is added
+        _LOCALCONF_TEMPS.append(tmp_conf)
+        configmgr.add_conf(tmp_conf.path)
+        _LOCALCONFS.append(tmp_conf.path)
+
+
+def forget_localconfs():
+    """
+    Remove local configs of projects read so far from configmgr, to read
+    config of another project.
+    """
+    from gitbuildsys.conf import configmgr
+    for path in _LOCALCONFS:
+        configmgr.remove_conf(path)
+    del _LOCALCONFS[:]
 
 
 class SearchConfAction(argparse.Action):
@@ -547,25 +1147,80 @@ class SearchConfAction(argparse.Action):
         read_localconf(workdir)
         setattr(namespace, self.dest, value)
 
+def _run_git_status(git_path, version):
+    """Run git status of given porcelain version, return its output."""
+    cmd = ['git', 'status', '--porcelain=%s' % version, '-z',
+           '--untracked-files=normal']
+    try:
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE,
+                                stderr=subprocess.PIPE, cwd=git_path)
+        out, err = proc.communicate()
+    except OSError, err:
+        raise GbsError('failed to run git status in %s: %s' % (git_path, err))
+    if proc.returncode:
+        raise GbsError('git status failed in %s: %s' % (git_path, err))
+    return out
+
+def git_status(git_path):
+    """
+    Get status of working copy by one pass of git status, which uses
+    untracked cache and fsmonitor if they are enabled in the repository.
+    Untracked dirs are reported as such, ending with '/', as untracked
+    cache works only in this mode. Porcelain v1 format is parsed instead
+    with git older than 2.11, which has no v2.
+    Returns: GitStatus of lists of uncommitted and untracked paths.
+    """
+    status = GitStatus([], [])
+    try:
+        out = _run_git_status(git_path, 'v2')
+    except GbsError:
+        out = _run_git_status(git_path, 'v1')
+        entries = iter(out.split('\0'))
+        for entry in entries:
+            if entry.startswith('?? '):
+                status.untracked.append(entry[3:])
+            elif entry:
+                status.uncommitted.append(entry[3:])
+                if entry[0] in 'RC':
+                    # renamed or copied, followed by original path
+                    status.uncommitted.append(next(entries))
+        return status
+
+    entries = iter(out.split('\0'))
+    for entry in entries:
+        if entry.startswith('? '):
+            status.untracked.append(entry[2:])
+        elif entry.startswith(('1 ', 'u ')):
+            status.uncommitted.append(entry.split(' ', 8 if entry[0] == '1'
+                                                  else 10)[-1])
+        elif entry.startswith('2 '):
+            # renamed or copied, followed by original path
+            status.uncommitted.append(entry.split(' ', 9)[-1])
+            status.uncommitted.append(next(entries))
+    return status
+
 def git_status_checker(git, opts):
     """
     Perform git repository status check.
     Warn user if repository is not clean or untracked files are found.
+    Returns: GitStatus of working copy, None for bare repositories.
     """
     try:
         if opts.commit:
             git.rev_parse(opts.commit)
-        is_clean = git.is_clean()[0]
-        status = git.status()
     except (GbpError, GitRepositoryError), err:
         raise GbsError(str(err))
-
-    untracked_files = status['??']
-    uncommitted_files = []
-    for stat in status:
-        if stat == '??':
-            continue
-        uncommitted_files.extend(status[stat])
+    if git.bare:
+        # nothing but committed revisions to check
+        if opts.include_all:
+            raise GbsError("--include-all can't be used with bare "
+                           "repository %s" % git.path)
+        return None
+
+    status = git_status(git.path)
+    untracked_files = status.untracked
+    uncommitted_files = status.uncommitted
+    is_clean = not (untracked_files or uncommitted_files)
 
     if not is_clean and not opts.include_all:
         if untracked_files:
@@ -583,8 +1238,74 @@ def git_status_checker(git, opts):
         if uncommitted_files:
             log.info('the following uncommitted changes would be included'
                      ':\n   %s' % '\n   '.join(uncommitted_files))
+    return status
 
-def hexdigest(fhandle, block_size=4096):
+def snapshot_working_copy(git_path, status):
+    """
+    Record working copy as a commit on top of HEAD, without touching the
+    index of the repository. Only paths changed according to status are
+    hashed. Commit date and author are taken from HEAD, so that the same
+    working copy always gives the same commit.
+    Returns: sha1 of the commit, or of HEAD if nothing has changed.
+    """
+    reader = get_git_reader(git_path)
+    head = reader.rev_parse('HEAD^{commit}')
+    if head is None:
+        raise GbsError('no commit to take working copy snapshot on in %s'
+                       % git_path)
+    if not (status.uncommitted or status.untracked):
+        return head
+
+    def git(args, stdin=None, env=None, strip=True):
+        """Run git command, return its output."""
+        try:
+            proc = subprocess.Popen(['git'] + args, stdin=subprocess.PIPE,
+                                    stdout=subprocess.PIPE,
+                                    stderr=subprocess.PIPE,
+                                    cwd=git_path, env=env)
+            out, err = proc.communicate(stdin)
+        except OSError, err:
+            raise GbsError('failed to run git %s: %s' % (args[0], err))
+        if proc.returncode:
+            raise GbsError('git %s failed in %s: %s' % (args[0], git_path,
+                                                        err))
+        return out.strip() if strip else out
+
+    paths = status.uncommitted + [path for path in status.untracked
+                                  if not path.endswith('/')]
+    untracked_dirs = [path for path in status.untracked if path.endswith('/')]
+    if untracked_dirs:
+        env = dict(os.environ, GIT_LITERAL_PATHSPECS='1')
+        out = git(['ls-files', '--others', '--exclude-standard', '-z', '--']
+                  + untracked_dirs, env=env, strip=False)
+        paths.extend(path for path in out.split('\0') if path)
+
+    # rev-parse --git-path needs git 2.5
+    index = os.path.join(git_path, os.environ.get('GIT_INDEX_FILE') or
+                         os.path.join(git(['rev-parse', '--git-dir']),
+                                      'index'))
+    tmp_index = Temp(prefix='gbs_index_')
+    env = dict(os.environ)
+    env['GIT_INDEX_FILE'] = tmp_index.path
+    if os.path.exists(index):
+        # stat info of index spares hashing of unchanged files
+        shutil.copy2(index, tmp_index.path)
+    else:
+        git(['read-tree', head], env=env)
+    git(['update-index', '--add', '--remove', '-z', '--stdin'],
+        stdin='\0'.join(paths) + '\0', env=env)
+    tree = git(['write-tree'], env=env)
+
+    commit_time = reader.commit_time(head)
+    env.update({'GIT_AUTHOR_NAME': 'gbs', 'GIT_AUTHOR_EMAIL': 'gbs@localhost',
+                'GIT_COMMITTER_NAME': 'gbs',
+                'GIT_COMMITTER_EMAIL': 'gbs@localhost',
+                'GIT_AUTHOR_DATE': '%d +0000' % commit_time,
+                'GIT_COMMITTER_DATE': '%d +0000' % commit_time})
+    return git(['commit-tree', tree, '-p', head, '-m',
+                'gbs: snapshot of working copy'], env=env)
+
+def hexdigest(fhandle, block_size=DIGEST_BLOCK_SIZE):
     """Calculate hexdigest of file content."""
     md5obj = hashlib.new('md5')
     while True:
@@ -595,14 +1316,280 @@ def hexdigest(fhandle, block_size=4096):
     return md5obj.hexdigest()
 
 
+class DigestCache(object):
+    """
+    Persistent cache of md5 of files, shared by gbs invocations. Entries
+    are keyed by device, inode, size and mtime of files, so files
+    hardlinked from the export cache are hashed only once.
+    """
+
+    def __init__(self, path, max_entries=DIGEST_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self._entries = None
+        self._dirty = False
+
+    def _load(self):
+        """Load entries saved by previous runs."""
+        if self._entries is None:
+            try:
+                with open(self.path) as fobj:
+                    self._entries = json.load(fobj)
+            except (IOError, ValueError):
+                self._entries = {}
+        return self._entries
+
+    def md5(self, fpath):
+        """Get md5 hexdigest of file."""
+        stat = os.stat(fpath)
+        key = '%d:%d:%d:%r' % (stat.st_dev, stat.st_ino, stat.st_size,
+                               stat.st_mtime)
+        entries = self._load()
+        if key in entries:
+            entries[key][1] = time.time()
+        else:
+            with open(fpath, 'rb') as fhandle:
+                entries[key] = [hexdigest(fhandle), time.time()]
+        self._dirty = True
+        return entries[key][0]
+
+    def save(self):
+        """Save most recently used entries for next runs."""
+        if not self._dirty:
+            return
+        entries = sorted(self._entries.iteritems(), key=lambda item: item[1][1],
+                         reverse=True)[:self.max_entries]
+        tmp_path = '%s.%d' % (self.path, os.getpid())
+        try:
+            if not os.path.exists(os.path.dirname(self.path)):
+                os.makedirs(os.path.dirname(self.path))
+            with open(tmp_path, 'w') as fobj:
+                json.dump(dict(entries), fobj)
+            os.rename(tmp_path, self.path)
+            self._dirty = False
+        except (IOError, OSError), err:
+            log.debug('failed to save digests to %s: %s' % (self.path, err))
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+
+
+def get_digest_cache():
+    """Return DigestCache shared by the whole process."""
+    global _DIGEST_CACHE
+    if _DIGEST_CACHE is None:
+        _DIGEST_CACHE = DigestCache(get_cachedir('digests.json'))
+    return _DIGEST_CACHE
+
+
+class GitObjectReader(object):
+    """
+    Read objects of one git repository through long-lived
+    'git cat-file --batch' and 'git cat-file --batch-check' processes,
+    instead of forking git for every query.
+    """
+
+    HEADER_RE = re.compile(r'^([0-9a-f]{40}) (\w+) (\d+)$')
+
+    def __init__(self, git_path):
+        self.git_path = os.path.abspath(git_path)
+        self._procs = {}
+
+    def _proc(self, mode):
+        """Get running cat-file process of given mode, start it if needed."""
+        proc = self._procs.get(mode)
+        if proc is None or proc.poll() is not None:
+            cmd = ['git', 'cat-file', mode]
+            try:
+                proc = subprocess.Popen(cmd, cwd=self.git_path,
+                                        stdin=subprocess.PIPE,
+                                        stdout=subprocess.PIPE)
+            except OSError, err:
+                raise GbsError('failed to run %s in %s: %s' %
+                               (' '.join(cmd), self.git_path, str(err)))
+            self._procs[mode] = proc
+        return proc
+
+    def _query(self, mode, obj):
+        """
+        Query one object.
+        Returns: tuple of (sha1, type, size, content), content is None for
+        --batch-check. None if object doesn't exist.
+        """
+        if '\n' in obj:
+            return None
+        proc = self._proc(mode)
+        try:
+            proc.stdin.write(obj + '\n')
+            proc.stdin.flush()
+            header = proc.stdout.readline()
+        except IOError:
+            header = ''
+        if not header:
+            self.close()
+            raise GbsError('git cat-file failed in %s' % self.git_path)
+
+        match = self.HEADER_RE.match(header.rstrip('\n'))
+        if not match:
+            # "<object> missing" or "<object> ambiguous"
+            return None
+        sha1, otype, size = match.group(1), match.group(2), \
+                            int(match.group(3))
+        content = None
+        if mode == '--batch':
+            content = proc.stdout.read(size)
+            proc.stdout.read(1)
+        return sha1, otype, size, content
+
+    @staticmethod
+    def _name(rev, path):
+        """Object name of path in given revision."""
+        return '%s:%s' % (rev, path.strip('/'))
+
+    def stat(self, rev, path):
+        """Get tuple of (sha1, type) of path in rev, None if missing."""
+        result = self._query('--batch-check', self._name(rev, path))
+        return result[:2] if result else None
+
+    def rev_parse(self, rev):
+        """Get sha1 of object rev refers to, None if missing."""
+        result = self._query('--batch-check', rev)
+        return result[0] if result else None
+
+    def commit_time(self, rev):
+        """Get committer timestamp of commit rev refers to, None if missing."""
+        result = self._query('--batch', '%s^{commit}' % rev)
+        if not result:
+            return None
+        for line in result[3].splitlines():
+            if line.startswith('committer '):
+                return int(line.rsplit(' ', 2)[1])
+            if not line:
+                break
+        return None
+
+    def object_type(self, rev, path):
+        """Get type of path in rev: 'blob', 'tree', ..., None if missing."""
+        result = self.stat(rev, path)
+        return result[1] if result else None
+
+    def show(self, rev, path):
+        """Get content of file in rev, None if it's not a file."""
+        result = self._query('--batch', self._name(rev, path))
+        if result and result[1] == 'blob':
+            return result[3]
+        return None
+
+    def _tree_entries(self, obj):
+        """
+        List tree object given by any object name.
+        Returns: list of (mode, name, sha1) tuples, None if it's not a tree.
+        """
+        result = self._query('--batch', obj)
+        if not result or result[1] != 'tree':
+            return None
+        content = result[3]
+        entries = []
+        pos = 0
+        while pos < len(content):
+            space = content.index(' ', pos)
+            nul = content.index('\0', space)
+            entries.append((content[pos:space], content[space + 1:nul],
+                            content[nul + 1:nul + 21].encode('hex')))
+            pos = nul + 21
+        return entries
+
+    def ls_tree(self, rev, path):
+        """
+        List directory in rev.
+        Returns: list of (mode, name, sha1) tuples, None if it's not a
+        directory.
+        """
+        return self._tree_entries(self._name(rev, path))
+
+    def walk(self, obj):
+        """
+        List tree object given by any object name recursively.
+        Returns: list of (mode, path) tuples in tree order, paths are
+        relative to the tree.
+        """
+        result = []
+        for mode, name, sha1 in self._tree_entries(obj) or []:
+            result.append((mode, name))
+            if mode == '40000':
+                result.extend((submode, '%s/%s' % (name, subpath))
+                              for submode, subpath in self.walk(sha1))
+        return result
+
+    def close(self):
+        """Stop cat-file processes."""
+        for proc in self._procs.values():
+            try:
+                proc.stdin.close()
+                proc.wait()
+            except (IOError, OSError):
+                pass
+        self._procs = {}
+
+    def __del__(self):
+        self.close()
+
+
+def get_git_reader(git_path):
+    """
+    Return GitObjectReader of git repository, shared by the whole process.
+    Readers of at most GIT_READERS_MAX repos are kept running.
+    """
+    git_path = os.path.abspath(git_path)
+    reader = _GIT_READERS.pop(git_path, None)
+    if reader is None:
+        reader = GitObjectReader(git_path)
+    _GIT_READERS[git_path] = reader
+    while len(_GIT_READERS) > GIT_READERS_MAX:
+        _GIT_READERS.popitem(last=False)[1].close()
+    return reader
+
+
+def forget_git_readers():
+    """
+    Drop readers inherited from parent process without stopping them, so
+    a forked child starts its own cat-file processes.
+    """
+    for reader in _GIT_READERS.values():
+        reader._procs = {}
+    _GIT_READERS.clear()
+
+
+def _init_pool_worker():
+    """Initialize process of pool_map()"""
+    forget_git_readers()
+    # let parent process handle Ctrl-C
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def pool_map(func, jobs, workers, threads=False, maxtasksperchild=None):
+    """
+    Run func on each of jobs in a pool of worker processes, or threads,
+    handing out one job at a time.
+    Returns: list of results, in order of jobs.
+    """
+    if threads:
+        pool = ThreadPool(workers)
+    else:
+        pool = multiprocessing.Pool(workers, _init_pool_worker,
+                                    maxtasksperchild=maxtasksperchild)
+    try:
+        # map_async().get() with timeout keeps Ctrl-C working
+        return pool.map_async(func, jobs, chunksize=1).get(2 ** 31)
+    finally:
+        pool.terminate()
+        pool.join()
+
+
 def show_file_from_rev(git_path, relative_path, commit_id):
     """Get a single file content from given git revision."""
-    args = ['git', 'show', '%s:%s' % (commit_id, relative_path)]
     try:
-        with Workdir(git_path):
-            return  subprocess.Popen(args,
-                                     stdout=subprocess.PIPE).communicate()[0]
-    except (subprocess.CalledProcessError, OSError), err:
+        return get_git_reader(git_path).show(commit_id, relative_path)
+    except GbsError, err:
         log.debug('failed to checkout %s from %s:%s' % (relative_path,
                                                         commit_id, str(err)))
     return None
@@ -610,38 +1597,569 @@ def show_file_from_rev(git_path, relative_path, commit_id):
 
 def file_exists_in_rev(git_path, relative_path, commit_id, dir_only=False):
     """Check if file exists in given given revision."""
-    git_opts = ['--name-only']
-    if dir_only:
-        git_opts += ['-d']
-    args = ['git', 'ls-tree', commit_id, relative_path]
-    args.extend(git_opts)
-
     try:
-        with Workdir(git_path):
-            output = subprocess.Popen(args,
-                                      stdout=subprocess.PIPE).communicate()[0]
-    except (subprocess.CalledProcessError, OSError), err:
+        otype = get_git_reader(git_path).object_type(commit_id,
+                                                     relative_path)
+    except GbsError, err:
         raise GbsError('failed to check existence of %s in %s:%s' % (
             relative_path, commit_id, str(err)))
 
-    return output != ''
+    if dir_only:
+        return otype == 'tree'
+    return otype is not None
 
 
 def glob_in_rev(git_path, pattern, commit_id):
     """Glob pattern in given revision."""
 
     path = os.path.dirname(pattern)
-    args = ['git', 'ls-tree', '--name-only', commit_id, '%s/' % path]
-
     try:
-        with Workdir(git_path):
-            output = subprocess.Popen(args,
-                                      stdout=subprocess.PIPE).communicate()[0]
-    except (subprocess.CalledProcessError, OSError), err:
+        entries = get_git_reader(git_path).ls_tree(commit_id, path)
+    except GbsError, err:
         raise GbsError('failed to glob %s in %s:%s' % (
             pattern, commit_id, str(err)))
 
-    return fnmatch.filter(output.splitlines(), pattern)
+    names = [os.path.join(path, name) for _mode, name, _ in entries or []]
+    return fnmatch.filter(names, pattern)
+
+
+def get_cachedir(name):
+    """Return path of persistent per user cache dir of given name."""
+    from gitbuildsys.conf import configmgr
+    return os.path.join(configmgr.get('tmpdir', 'general'),
+                        '%s-gbs' % pwd.getpwuid(os.getuid())[0], name)
+
+
+def git_blob_sha1(content):
+    """Calculate sha1 git would give to a blob of given content."""
+    sha1 = hashlib.sha1('blob %d\0' % len(content))
+    sha1.update(content)
+    return sha1.hexdigest()
+
+
+def rpm_macros_fingerprint():
+    """Fingerprint of rpm macro files, which spec parsing depends on."""
+    global _RPM_MACROS_FINGERPRINT
+    if _RPM_MACROS_FINGERPRINT is None:
+        sha1 = hashlib.sha1()
+        for pattern in RPM_MACRO_FILES:
+            for path in sorted(glob.glob(os.path.expanduser(pattern))):
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                sha1.update('%s %d %d\n' % (path, stat.st_mtime,
+                                             stat.st_size))
+        _RPM_MACROS_FINGERPRINT = sha1.hexdigest()
+    return _RPM_MACROS_FINGERPRINT
+
+
+class SpecCache(object):
+    """
+    Persistent cache of header fields of spec files, shared by gbs
+    invocations. Entries are keyed by git blob sha1 of spec content and
+    fingerprint of rpm macros, so unchanged specs are not parsed again.
+    """
+
+    def __init__(self, cachedir, max_entries=SPEC_CACHE_MAX_ENTRIES):
+        self.cachedir = cachedir
+        self.max_entries = max_entries
+        self._pruned = False
+
+    def _path(self, content):
+        """Path of cache entry of spec content."""
+        key = hashlib.sha1('%s %s %d' % (git_blob_sha1(content),
+                                         rpm_macros_fingerprint(),
+                                         SPEC_CACHE_VERSION)).hexdigest()
+        return os.path.join(self.cachedir, key)
+
+    def get(self, content):
+        """Get SpecInfo of spec content, None if not cached."""
+        path = self._path(content)
+        try:
+            with open(path) as fobj:
+                info = SpecInfo(**json.load(fobj))
+            os.utime(path, None)
+            return info
+        except (IOError, OSError, ValueError, TypeError):
+            return None
+
+    def put(self, content, info):
+        """Save SpecInfo of spec content."""
+        path = self._path(content)
+        tmp_path = '%s.%d' % (path, os.getpid())
+        try:
+            if not os.path.exists(self.cachedir):
+                os.makedirs(self.cachedir)
+            self.prune()
+            with open(tmp_path, 'w') as fobj:
+                json.dump(info._asdict(), fobj)
+            os.rename(tmp_path, path)
+        except (IOError, OSError), err:
+            log.debug('failed to save spec info to %s: %s' % (path, err))
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+
+    def prune(self):
+        """Remove oldest entries over max_entries, once per process."""
+        if self._pruned:
+            return
+        self._pruned = True
+        entries = []
+        for name in os.listdir(self.cachedir):
+            path = os.path.join(self.cachedir, name)
+            try:
+                entries.append((os.stat(path).st_mtime, path))
+            except OSError:
+                continue
+        entries.sort()
+        for _mtime, path in entries[:max(0, len(entries) - self.max_entries)]:
+            os.unlink(path)
+
+
+def get_spec_cache():
+    """Return SpecCache shared by the whole process."""
+    global _SPEC_CACHE
+    if _SPEC_CACHE is None:
+        _SPEC_CACHE = SpecCache(get_cachedir('speccache'))
+    return _SPEC_CACHE
+
+
+class UnsupportedSpec(Exception):
+    """Spec uses constructs SpecHeaderParser can't evaluate."""
+
+
+class SpecHeaderParser(object):
+    """
+    Pure python parser of Name, Version, Release and Epoch of main package
+    of spec file. Only simple %define and %global macros defined in the
+    spec itself are expanded, anything else raises UnsupportedSpec.
+    """
+
+    TAG_RE = re.compile(r'^(Name|Version|Release|Epoch)\s*:\s*(.*)$', re.I)
+    DEFINE_RE = re.compile(r'^%(define|global)\s+(\w+)(\(.*?\))?\s+(.*)$')
+    SECTION_RE = re.compile(r'^%(package|description|prep|build|install|'
+                            r'check|clean|files|changelog|pre|post|preun|'
+                            r'postun|pretrans|posttrans|trigger\w*|'
+                            r'verifyscript)\b')
+    MACRO_RE = re.compile(r'%(%|\{[^{}]*\}|\w+)')
+    MAX_DEPTH = 16
+
+    def __init__(self, content):
+        self.content = content
+        self.macros = {}
+        self.tags = {}
+
+    def expand(self, value, depth=0):
+        """Expand macros of value."""
+        if depth > self.MAX_DEPTH:
+            raise UnsupportedSpec('too deep recursion expanding %s' % value)
+        if '%' not in value:
+            return value
+        if '%(' in value or '%[' in value:
+            raise UnsupportedSpec('shell or expression macro in %s' % value)
+        return self.MACRO_RE.sub(lambda match: self._expand_macro(
+            match.group(1), depth), value)
+
+    def _expand_macro(self, macro, depth):
+        """Expand one macro, given without leading %."""
+        if macro == '%':
+            return '%'
+        if macro.startswith('{'):
+            macro = macro[1:-1]
+            conditional = macro.startswith('?')
+            if conditional:
+                macro = macro[1:]
+            if not re.match(r'^\w+$', macro):
+                raise UnsupportedSpec('unsupported macro %%{%s}' % macro)
+        if macro not in self.macros:
+            # could be defined by rpm macro files, let rpm decide
+            raise UnsupportedSpec('unknown macro %%%s' % macro)
+        return self.expand(self.macros[macro], depth + 1)
+
+    def parse(self):
+        """Parse content and return SpecInfo."""
+        for line in self.content.splitlines():
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            if self.SECTION_RE.match(line):
+                break
+            try:
+                self._parse_line(line)
+            except UnsupportedSpec:
+                # constructs after main tags can't change them,
+                # only Epoch is looked for
+                if all(tag in self.tags for tag in
+                       ('name', 'version', 'release')):
+                    break
+                raise
+
+        for tag in ('name', 'version', 'release'):
+            if not self.tags.get(tag):
+                raise UnsupportedSpec('%s tag not found' % tag)
+        version = {'upstreamversion': self.tags['version'],
+                   'release': self.tags['release']}
+        if 'epoch' in self.tags:
+            version['epoch'] = self.tags['epoch']
+        return SpecInfo(self.tags['name'], version, self.tags['version'],
+                        self.tags['release'])
+
+    def _parse_line(self, line):
+        """Parse one line of spec preamble."""
+        if line.endswith('\\'):
+            raise UnsupportedSpec('multi-line construct: %s' % line)
+        match = self.TAG_RE.match(line)
+        if match:
+            tag = match.group(1).lower()
+            if tag in self.tags:
+                raise UnsupportedSpec('duplicated %s tag' % tag)
+            value = self.expand(match.group(2).strip())
+            if '%' in value:
+                raise UnsupportedSpec('unexpanded %s: %s' % (tag, value))
+            self.tags[tag] = value
+            if tag != 'epoch':
+                # rpm defines macros of main tags
+                self.macros[tag] = value
+            return
+        match = self.DEFINE_RE.match(line)
+        if match:
+            kind, name, args, value = match.groups()
+            if args is not None:
+                raise UnsupportedSpec('parametric macro %s' % name)
+            if kind == 'global':
+                value = self.expand(value)
+            self.macros[name] = value
+            return
+        if line.startswith('%'):
+            raise UnsupportedSpec('unsupported construct: %s' % line)
+        if '%' in line:
+            # other tags, expansion errors of them would fail rpm
+            self.expand(line)
+
+
+# number of spec files parsed by each way, see parse_spec()
+SPEC_PARSE_STATS = defaultdict(int)
+
+
+def spec_parse_stats_since(before):
+    """Get counts of SPEC_PARSE_STATS added since before, a copy of it"""
+    return dict((way, count - before.get(way, 0))
+                for way, count in SPEC_PARSE_STATS.iteritems())
+
+
+def merge_spec_parse_stats(stats):
+    """Add counts of parse_spec() calls made by a worker process"""
+    for way, count in stats.iteritems():
+        SPEC_PARSE_STATS[way] += count
+
+
+def log_spec_parse_stats():
+    """Log how many spec files parse_spec() got in each way"""
+    total = sum(SPEC_PARSE_STATS.values())
+    if total:
+        log.info('%d spec files parsed: %d cached, %d by fast path, '
+                 '%d by rpm (%d%% without rpm)' % \
+                 (total, SPEC_PARSE_STATS['cache'], SPEC_PARSE_STATS['fast'],
+                  SPEC_PARSE_STATS['rpm'],
+                  100 * (total - SPEC_PARSE_STATS['rpm']) / total))
+
+
+def parse_spec(content):
+    """
+    Get SpecInfo (name, version, upstreamversion and release) of spec file
+    of given content. SpecHeaderParser is tried first if it's not cached,
+    gbp.rpm.SpecFile is used only for specs it can't evaluate.
+    """
+    cache = get_spec_cache()
+    info = cache.get(content)
+    if info is not None:
+        SPEC_PARSE_STATS['cache'] += 1
+        log.debug('spec parsing: cached')
+        return info
+
+    try:
+        info = SpecHeaderParser(content).parse()
+        SPEC_PARSE_STATS['fast'] += 1
+        log.debug('spec parsing: fast path')
+    except UnsupportedSpec, err:
+        SPEC_PARSE_STATS['rpm'] += 1
+        log.debug('spec parsing: falling back to rpm, %s' % err)
+        tmp_spec = Temp(content=content)
+        try:
+            spec = gbp.rpm.SpecFile(tmp_spec.path)
+        except GbpError, err:
+            raise GbsError('%s' % err)
+        info = SpecInfo(spec.name, spec.version, spec.upstreamversion,
+                        spec.release)
+    cache.put(content, info)
+    return info
+
+
+def copy_export_tree(src, dst, link_size=EXPORT_CACHE_LINK_SIZE):
+    """
+    Copy tree of exported files, hardlinking files of at least link_size
+    if possible.
+    """
+    if not os.path.exists(dst):
+        os.makedirs(dst)
+    for name in os.listdir(src):
+        src_path = os.path.join(src, name)
+        dst_path = os.path.join(dst, name)
+        if os.path.islink(src_path):
+            os.symlink(os.readlink(src_path), dst_path)
+        elif os.path.isdir(src_path):
+            copy_export_tree(src_path, dst_path, link_size)
+        else:
+            if os.path.getsize(src_path) >= link_size:
+                try:
+                    os.link(src_path, dst_path)
+                    continue
+                except OSError:
+                    pass
+            shutil.copy2(src_path, dst_path)
+            os.chmod(dst_path, os.stat(dst_path).st_mode | 0200)
+
+
+class _CompressorFile(object):
+    """Write only file object compressing data into fileobj."""
+
+    def __init__(self, fileobj, compressor):
+        self.fileobj = fileobj
+        self.compressor = compressor
+
+    def write(self, data):
+        """Compress data into fileobj."""
+        self.fileobj.write(self.compressor.compress(data))
+
+    def close(self):
+        """Write rest of compressed data, fileobj is left open."""
+        self.fileobj.write(self.compressor.flush())
+
+def normalize_tarball(path, mtime, compresslevel=6):
+    """
+    Rewrite tarball so that identical trees give byte-identical tarballs:
+    entries get root ownership, gzip header carries neither timestamp nor
+    file name and the commit id git archive stores in a global pax header
+    is dropped. Entries archived from a commit keep its time git archive
+    gave them, others get the given mtime. Entry order is kept, as git
+    archive already writes entries sorted by path. Tarballs are compressed
+    again the way their names tell, xz and zstd in a single thread.
+    Returns: True if path is a tarball which has been rewritten.
+    """
+    for suffixes, compression in TARBALL_COMPRESSIONS:
+        if path.endswith(suffixes):
+            break
+    else:
+        if '.tar.' in os.path.basename(path):
+            log.warning('tarball %s is not normalized, its compression is '
+                        'not supported' % path)
+        return False
+
+    tmp_path = '%s.%d.tmp' % (path, os.getpid())
+    procs = []
+    try:
+        with open(tmp_path, 'wb') as fobj:
+            out = fobj
+            if compression in ('xz', 'zstd'):
+                procs.append(subprocess.Popen([compression, '-d', '-c', '-q',
+                                               path], stdout=subprocess.PIPE))
+                procs.append(subprocess.Popen([compression, '-c', '-q', '-T1',
+                                               '-%d' % compresslevel],
+                                              stdin=subprocess.PIPE,
+                                              stdout=fobj))
+                src = tarfile.open(fileobj=procs[0].stdout, mode='r|')
+                out = procs[1].stdin
+            else:
+                src = tarfile.open(path, 'r|*')
+            if compression == 'gz':
+                out = gzip.GzipFile(filename='', mode='wb', fileobj=fobj,
+                                    compresslevel=compresslevel, mtime=0)
+            elif compression == 'bz2':
+                out = _CompressorFile(fobj, bz2.BZ2Compressor(compresslevel))
+            pax_headers = dict(src.pax_headers)
+            from_commit = pax_headers.pop('comment', None) is not None
+            dst = tarfile.open(fileobj=out, mode='w|',
+                               format=tarfile.PAX_FORMAT,
+                               pax_headers=pax_headers)
+            for member in src:
+                if not from_commit:
+                    member.mtime = mtime
+                member.uid = member.gid = 0
+                member.uname = member.gname = 'root'
+                dst.addfile(member, src.extractfile(member)
+                            if member.isreg() else None)
+            dst.close()
+            src.close()
+            if out is not fobj:
+                out.close()
+            if procs:
+                # rest of decompressed tarball is padding
+                procs[0].stdout.read()
+            for proc in procs:
+                if proc.wait():
+                    raise OSError('%s exited with %d' % (compression,
+                                                         proc.returncode))
+        os.rename(tmp_path, path)
+    except (IOError, OSError, tarfile.TarError), err:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise GbsError('failed to normalize tarball %s: %s' % (path, err))
+    finally:
+        for proc in procs:
+            if proc.poll() is None:
+                proc.kill()
+                proc.wait()
+    return True
+
+
+class ExportCache(object):
+    """
+    Persistent cache of packaging files exported by gbp, shared by gbs
+    invocations. Entries are dirs named by keys given by the caller and
+    least recently used ones are evicted over max_size.
+    """
+
+    def __init__(self, cachedir, max_size=EXPORT_CACHE_MAX_SIZE):
+        self.cachedir = cachedir
+        self.max_size = max_size
+
+    def get(self, key, export_dir):
+        """Fill export_dir from cache entry of key, False if not cached."""
+        path = os.path.join(self.cachedir, key)
+        if not os.path.isdir(path):
+            return False
+        try:
+            copy_export_tree(path, export_dir)
+            os.utime(path, None)
+        except (IOError, OSError), err:
+            log.debug('failed to use export cache %s: %s' % (path, err))
+            return False
+        return True
+
+    def put(self, key, export_dir):
+        """Save files of export_dir as cache entry of key."""
+        path = os.path.join(self.cachedir, key)
+        tmp_path = '%s.%d.tmp' % (path, os.getpid())
+        try:
+            # files hardlinked from entries must not be changed in place
+            copy_export_tree(export_dir, tmp_path, link_size=sys.maxint)
+            for dirpath, _dirs, files in os.walk(tmp_path):
+                for fname in files:
+                    fpath = os.path.join(dirpath, fname)
+                    if not os.path.islink(fpath):
+                        os.chmod(fpath, os.stat(fpath).st_mode & ~0222)
+            os.rename(tmp_path, path)
+        except (IOError, OSError), err:
+            # also entry of the same key saved by others meanwhile
+            log.debug('failed to save export cache %s: %s' % (path, err))
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            return
+        self.evict(keep=key)
+
+    def evict(self, keep=None):
+        """Remove least recently used entries over max_size."""
+        entries = []
+        total = 0
+        for name in os.listdir(self.cachedir):
+            path = os.path.join(self.cachedir, name)
+            size = 0
+            for dirpath, _dirs, files in os.walk(path):
+                for fname in files:
+                    try:
+                        size += os.lstat(os.path.join(dirpath, fname)).st_size
+                    except OSError:
+                        pass
+            try:
+                entries.append((os.stat(path).st_mtime, size, name))
+            except OSError:
+                continue
+            total += size
+        entries.sort()
+        for _mtime, size, name in entries:
+            if total <= self.max_size:
+                break
+            if name == keep:
+                continue
+            log.debug('evicting %s from export cache' % name)
+            shutil.rmtree(os.path.join(self.cachedir, name),
+                          ignore_errors=True)
+            total -= size
+
+
+class PatchCache(object):
+    """
+    Persistent cache of patch files generated from single commits, shared
+    by gbs invocations. Entries are dirs named by keys given by the caller,
+    holding the patch file at its path relative to the patch dir, or
+    nothing if the commit gave no patch.
+    """
+
+    def __init__(self, cachedir, max_entries=PATCH_CACHE_MAX_ENTRIES):
+        self.cachedir = cachedir
+        self.max_entries = max_entries
+        self._pruned = False
+
+    def get(self, key, outdir):
+        """
+        Copy patch of cache entry of key into outdir.
+        Returns: tuple of (hit, path of patch or None if there's no patch).
+        """
+        path = os.path.join(self.cachedir, key)
+        if not os.path.isdir(path):
+            return False, None
+        try:
+            patches = [os.path.join(dirpath, fname)
+                       for dirpath, _dirs, files in os.walk(path)
+                       for fname in files]
+            if not patches:
+                os.utime(path, None)
+                return True, None
+            relpath = os.path.relpath(patches[0], path)
+            patch = os.path.join(outdir, relpath)
+            if not os.path.isdir(os.path.dirname(patch)):
+                os.makedirs(os.path.dirname(patch))
+            shutil.copy2(patches[0], patch)
+            os.utime(path, None)
+        except (IOError, OSError), err:
+            log.debug('failed to use patch cache %s: %s' % (path, err))
+            return False, None
+        return True, patch
+
+    def put(self, key, outdir, patch):
+        """Save patch generated into outdir, None if there's no patch."""
+        path = os.path.join(self.cachedir, key)
+        tmp_path = '%s.%d.tmp' % (path, os.getpid())
+        try:
+            os.makedirs(tmp_path)
+            if patch:
+                relpath = os.path.relpath(patch, outdir)
+                if os.path.dirname(relpath):
+                    os.makedirs(os.path.join(tmp_path,
+                                             os.path.dirname(relpath)))
+                shutil.copy2(patch, os.path.join(tmp_path, relpath))
+            os.rename(tmp_path, path)
+        except (IOError, OSError), err:
+            log.debug('failed to save patch cache %s: %s' % (path, err))
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            return
+        self.prune()
+
+    def prune(self):
+        """Remove oldest entries over max_entries, once per process."""
+        if self._pruned:
+            return
+        self._pruned = True
+        entries = []
+        for name in os.listdir(self.cachedir):
+            path = os.path.join(self.cachedir, name)
+            try:
+                entries.append((os.stat(path).st_mtime, path))
+            except OSError:
+                continue
+        entries.sort()
+        for _mtime, path in entries[:max(0, len(entries) - self.max_entries)]:
+            shutil.rmtree(path, ignore_errors=True)
 
 
 def get_editor_cmd():
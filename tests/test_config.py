@@ -155,6 +155,17 @@ class ConfigGettingTest(unittest.TestCase):
                                    'project1.ini'))
         self.assertEqual('homev2', self.get('section', 'home_only_key'))
 
+    @Fixture(home='home1.ini')
+    def test_removeconf(self):
+        '''removed config no longer overrides others'''
+        reload(gitbuildsys.conf)
+        configmgr = gitbuildsys.conf.configmgr
+        project = os.path.join(FILE_DIRNAME, 'testdata', 'ini', 'project1.ini')
+        configmgr.add_conf(project)
+        self.assertEqual('projv1', configmgr.get('common_key', 'section'))
+        configmgr.remove_conf(project)
+        self.assertEqual('homev1', configmgr.get('common_key', 'section'))
+
 
 if __name__ == '__main__':
     unittest.main()
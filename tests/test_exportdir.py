@@ -0,0 +1,74 @@
+#!/usr/bin/python -tt
+# vim: ai ts=4 sts=4 et sw=4
+#
+# Copyright (c) 2012 Intel, Inc.
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation; version 2 of the License
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License
+# for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc., 59
+# Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+
+"""Unit tests of merging exports of multiple spec files"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from gitbuildsys.cmd_export import merge_rest_exports
+
+SPECS = ('main.spec', 'a.spec', 'b.spec')
+
+
+class MergeRestExportsTest(unittest.TestCase):
+    '''Test merge_rest_exports'''
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix='test-gbs-exportdir-')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir, True)
+
+    def export(self, name, spec, files):
+        '''
+        Fake export of spec: all specs of packaging dir are copied,
+        only the exported one is updated
+        '''
+        path = os.path.join(self.tmpdir, name)
+        os.makedirs(path)
+        for specfile in SPECS:
+            content = 'updated' if specfile == os.path.basename(spec) \
+                      else 'unmodified'
+            with open(os.path.join(path, specfile), 'w') as fobj:
+                fobj.write(content)
+        for fname, content in files.iteritems():
+            with open(os.path.join(path, fname), 'w') as fobj:
+                fobj.write(content)
+        return path
+
+    def read(self, fname):
+        '''content of merged file'''
+        with open(os.path.join(self.tmpdir, 'main', fname)) as fobj:
+            return fobj.read()
+
+    def test_every_spec_updated(self):
+        '''each spec comes from its own export'''
+        export_dir = self.export('main', 'main.spec',
+                                 {'foo.tar.gz': 'tarball', 'common': 'main'})
+        rest = [(spec, self.export(spec, spec, {'common': spec}))
+                for spec in ('packaging/a.spec', 'packaging/b.spec')]
+
+        merge_rest_exports(export_dir, 'packaging/main.spec', rest)
+
+        for specfile in SPECS:
+            self.assertEqual('updated', self.read(specfile))
+        self.assertEqual('tarball', self.read('foo.tar.gz'))
+        self.assertEqual('packaging/b.spec', self.read('common'))
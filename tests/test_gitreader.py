@@ -0,0 +1,116 @@
+#!/usr/bin/python -tt
+# vim: ai ts=4 sts=4 et sw=4
+#
+# Copyright (c) 2012 Intel, Inc.
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation; version 2 of the License
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License
+# for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc., 59
+# Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+
+"""Unit tests for class GitObjectReader and helpers using it"""
+
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+
+from gitbuildsys.utils import GitObjectReader, file_exists_in_rev, \
+                              glob_in_rev, show_file_from_rev
+
+GIT_ENV = dict(os.environ, GIT_AUTHOR_NAME='test',
+               GIT_AUTHOR_EMAIL='test@localhost', GIT_COMMITTER_NAME='test',
+               GIT_COMMITTER_EMAIL='test@localhost',
+               GIT_AUTHOR_DATE='1400000000 +0000',
+               GIT_COMMITTER_DATE='1400000000 +0000')
+
+
+def git(path, *args):
+    '''run git command in path, return its output'''
+    return subprocess.check_output(('git',) + args, cwd=path, env=GIT_ENV)
+
+
+class GitObjectReaderTest(unittest.TestCase):
+    '''Test GitObjectReader class'''
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp(prefix='test-gbs-gitreader-')
+        git(self.path, 'init', '-q')
+        os.makedirs(os.path.join(self.path, 'packaging'))
+        for name, content in (('packaging/foo.spec', 'Name: foo\n'),
+                              ('packaging/bar.spec', 'Name: bar\n'),
+                              ('packaging/foo.changes', ''),
+                              ('with space', 'x\n')):
+            with open(os.path.join(self.path, name), 'w') as fobj:
+                fobj.write(content)
+        git(self.path, 'add', '.')
+        git(self.path, 'commit', '-q', '-m', 'initial')
+        self.reader = GitObjectReader(self.path)
+
+    def tearDown(self):
+        self.reader.close()
+        shutil.rmtree(self.path, True)
+
+    def test_show(self):
+        '''file content is read, dirs and missing files give None'''
+        self.assertEqual('Name: foo\n',
+                         self.reader.show('HEAD', 'packaging/foo.spec'))
+        self.assertEqual('x\n', self.reader.show('HEAD', 'with space'))
+        self.assertEqual(None, self.reader.show('HEAD', 'packaging'))
+        self.assertEqual(None, self.reader.show('HEAD', 'missing'))
+        self.assertEqual(None, self.reader.show('HEAD', 'bad\nname'))
+
+    def test_rev_parse_and_commit_time(self):
+        '''commits are resolved like git rev-parse'''
+        self.assertEqual(git(self.path, 'rev-parse', 'HEAD').strip(),
+                         self.reader.rev_parse('HEAD'))
+        self.assertEqual(1400000000, self.reader.commit_time('HEAD'))
+        self.assertEqual(None, self.reader.rev_parse('nosuchbranch'))
+        self.assertEqual(None, self.reader.commit_time('nosuchbranch'))
+
+    def test_object_type(self):
+        '''types of paths in revision'''
+        self.assertEqual('tree', self.reader.object_type('HEAD', 'packaging/'))
+        self.assertEqual('blob',
+                         self.reader.object_type('HEAD', 'packaging/foo.spec'))
+        self.assertEqual(None, self.reader.object_type('HEAD', 'missing'))
+
+    def test_ls_tree_and_walk(self):
+        '''tree entries are listed in tree order'''
+        names = [name for _mode, name, _sha1 in
+                 self.reader.ls_tree('HEAD', 'packaging')]
+        self.assertEqual(['bar.spec', 'foo.changes', 'foo.spec'], names)
+        self.assertEqual(None, self.reader.ls_tree('HEAD', 'with space'))
+        self.assertEqual(['packaging', 'packaging/bar.spec',
+                          'packaging/foo.changes', 'packaging/foo.spec',
+                          'with space'],
+                         [path for _mode, path in
+                          self.reader.walk('HEAD^{tree}')])
+
+    def test_restart_after_close(self):
+        '''closed reader starts new processes'''
+        self.reader.close()
+        self.assertEqual('x\n', self.reader.show('HEAD', 'with space'))
+
+    def test_helpers(self):
+        '''file_exists_in_rev, glob_in_rev and show_file_from_rev'''
+        self.assertTrue(file_exists_in_rev(self.path, 'packaging', 'HEAD',
+                                           dir_only=True))
+        self.assertFalse(file_exists_in_rev(self.path, 'with space', 'HEAD',
+                                            dir_only=True))
+        self.assertTrue(file_exists_in_rev(self.path, 'with space', 'HEAD'))
+        self.assertFalse(file_exists_in_rev(self.path, 'missing', 'HEAD'))
+        self.assertEqual(['packaging/bar.spec', 'packaging/foo.spec'],
+                         glob_in_rev(self.path, 'packaging/*.spec', 'HEAD'))
+        self.assertEqual([], glob_in_rev(self.path, 'missing/*.spec', 'HEAD'))
+        self.assertEqual('Name: bar\n', show_file_from_rev(
+            self.path, 'packaging/bar.spec', 'HEAD'))
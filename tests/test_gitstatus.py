@@ -0,0 +1,136 @@
+#!/usr/bin/python -tt
+# vim: ai ts=4 sts=4 et sw=4
+#
+# Copyright (c) 2012 Intel, Inc.
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation; version 2 of the License
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License
+# for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc., 59
+# Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+
+"""Unit tests of git_status and snapshot_working_copy"""
+
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+
+from gitbuildsys import utils
+from gitbuildsys.errors import GbsError
+from gitbuildsys.utils import git_status, snapshot_working_copy
+
+GIT_ENV = dict(os.environ, GIT_AUTHOR_NAME='test',
+               GIT_AUTHOR_EMAIL='test@localhost', GIT_COMMITTER_NAME='test',
+               GIT_COMMITTER_EMAIL='test@localhost')
+
+
+def git(path, *args):
+    '''run git command in path, return its output'''
+    return subprocess.check_output(('git',) + args, cwd=path, env=GIT_ENV,
+                                   stderr=subprocess.STDOUT)
+
+
+class GitStatusTest(unittest.TestCase):
+    '''Test git_status and snapshot_working_copy'''
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp(prefix='test-gbs-gitstatus-')
+        git(self.path, 'init', '-q')
+        for name in ('a', 'old name', 'c'):
+            self.write(name, '%s\n' % name)
+        git(self.path, 'add', '.')
+        git(self.path, 'commit', '-q', '-m', 'initial')
+
+    def tearDown(self):
+        shutil.rmtree(self.path, True)
+
+    def write(self, name, content):
+        '''write file of working copy'''
+        path = os.path.join(self.path, name)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'w') as fobj:
+            fobj.write(content)
+
+    def test_clean(self):
+        '''clean working copy has no changes'''
+        status = git_status(self.path)
+        self.assertEqual(([], []), (status.uncommitted, status.untracked))
+        self.assertEqual(git(self.path, 'rev-parse', 'HEAD').strip(),
+                         snapshot_working_copy(self.path, status))
+
+    def test_changes(self):
+        '''modified, deleted, renamed and untracked paths'''
+        self.write('a', 'changed\n')
+        os.unlink(os.path.join(self.path, 'c'))
+        git(self.path, 'mv', 'old name', 'new name')
+        self.write('new file', '')
+        self.write('new dir/x y', '')
+        self.write('new dir/sub/z', '')
+
+        status = git_status(self.path)
+        self.assertEqual(['a', 'c', 'new name', 'old name'],
+                         sorted(status.uncommitted))
+        self.assertEqual(['new dir/', 'new file'], sorted(status.untracked))
+
+    def test_porcelain_v1(self):
+        '''git without porcelain v2 gives the same status'''
+        self.write('a', 'changed\n')
+        os.unlink(os.path.join(self.path, 'c'))
+        git(self.path, 'mv', 'old name', 'new name')
+        self.write('new dir/x y', '')
+        expected = git_status(self.path)
+
+        run_git_status = utils._run_git_status
+        def run_v1_only(git_path, version):
+            '''git status of git older than 2.11'''
+            if version != 'v1':
+                raise GbsError('unsupported porcelain version')
+            return run_git_status(git_path, version)
+        utils._run_git_status = run_v1_only
+        try:
+            status = git_status(self.path)
+        finally:
+            utils._run_git_status = run_git_status
+        self.assertEqual(sorted(expected.uncommitted),
+                         sorted(status.uncommitted))
+        self.assertEqual(sorted(expected.untracked), sorted(status.untracked))
+
+    def test_unmerged(self):
+        '''conflicting paths are uncommitted'''
+        git(self.path, 'checkout', '-q', '-b', 'other')
+        self.write('old name', 'other\n')
+        git(self.path, 'commit', '-q', '-a', '-m', 'other')
+        git(self.path, 'checkout', '-q', '-')
+        self.write('old name', 'mine\n')
+        git(self.path, 'commit', '-q', '-a', '-m', 'mine')
+        self.assertRaises(subprocess.CalledProcessError, git, self.path,
+                          'merge', '-q', 'other')
+
+        self.assertEqual(['old name'], git_status(self.path).uncommitted)
+
+    def test_snapshot(self):
+        '''snapshot has all changes, is stable and leaves index alone'''
+        self.write('a', 'changed\n')
+        os.unlink(os.path.join(self.path, 'c'))
+        self.write('new dir/x y', 'x\n')
+        self.write('new dir/sub/z', 'z\n')
+        index = git(self.path, 'ls-files', '--stage')
+
+        commit = snapshot_working_copy(self.path, git_status(self.path))
+        self.assertEqual(commit, snapshot_working_copy(self.path,
+                                                       git_status(self.path)))
+        self.assertEqual(index, git(self.path, 'ls-files', '--stage'))
+        self.assertEqual('a\nnew dir/sub/z\nnew dir/x y\nold name\n',
+                         git(self.path, 'ls-tree', '-r', '--name-only',
+                             commit))
+        self.assertEqual('changed\n', git(self.path, 'show', '%s:a' % commit))
@@ -0,0 +1,131 @@
+#!/usr/bin/python -tt
+# vim: ai ts=4 sts=4 et sw=4
+#
+# Copyright (c) 2012 Intel, Inc.
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation; version 2 of the License
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License
+# for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc., 59
+# Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+
+"""Unit tests for class HttpCache"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from gitbuildsys.utils import HttpCache, PageNotFound
+
+
+class FakeGrabber(object):
+    '''Fake URLGrabber serving pages from a dictionary'''
+
+    def __init__(self, pages):
+        self.pages = pages
+        self.requests = []
+
+    def grab(self, url, filename, user=None, passwd=None, no_cache=False,
+             headers=None):
+        '''write page content into filename'''
+        self.requests.append((url, headers))
+        if url not in self.pages:
+            raise PageNotFound(url)
+        content, etag = self.pages[url]
+        if 'If-None-Match: %s' % etag in (headers or []):
+            return 304, {}
+        with open(filename, 'w') as fobj:
+            fobj.write(content)
+        return 200, {'etag': etag}
+
+    def grab_many(self, requests):
+        '''serial version of URLGrabber.grab_many'''
+        results = []
+        for request in requests:
+            try:
+                results.append(self.grab(*request))
+            except PageNotFound, err:
+                results.append(err)
+        return results
+
+
+class HttpCacheTest(unittest.TestCase):
+    '''Test HttpCache class'''
+
+    def setUp(self):
+        self.cachedir = tempfile.mkdtemp(prefix='test-gbs-httpcache-')
+        self.grabber = FakeGrabber({'http://a/repomd.xml': ('A', '"1"'),
+                                    'http://b/repomd.xml': ('BB', '"2"')})
+
+    def tearDown(self):
+        shutil.rmtree(self.cachedir, True)
+
+    def test_keyed_by_full_url(self):
+        '''same basename of different urls doesn't collide'''
+        cache = HttpCache(self.cachedir)
+        fname_a = cache.fetch(self.grabber, 'http://a/repomd.xml')
+        fname_b = cache.fetch(self.grabber, 'http://b/repomd.xml')
+
+        self.assertNotEqual(fname_a, fname_b)
+        self.assertEqual('A', open(fname_a).read())
+        self.assertEqual('BB', open(fname_b).read())
+
+    def test_revalidated_once_per_process(self):
+        '''second fetch in same process doesn't go to network'''
+        cache = HttpCache(self.cachedir)
+        cache.fetch(self.grabber, 'http://a/repomd.xml')
+        cache.fetch(self.grabber, 'http://a/repomd.xml')
+
+        self.assertEqual(1, len(self.grabber.requests))
+
+    def test_conditional_request(self):
+        '''next process sends validators and keeps content on 304'''
+        HttpCache(self.cachedir).fetch(self.grabber, 'http://a/repomd.xml')
+        fname = HttpCache(self.cachedir).fetch(self.grabber,
+                                               'http://a/repomd.xml')
+
+        self.assertEqual(['If-None-Match: "1"'], self.grabber.requests[-1][1])
+        self.assertEqual('A', open(fname).read())
+
+    def test_not_found_drops_entry(self):
+        '''entry is removed if page disappeared'''
+        HttpCache(self.cachedir).fetch(self.grabber, 'http://a/repomd.xml')
+        del self.grabber.pages['http://a/repomd.xml']
+
+        cache = HttpCache(self.cachedir)
+        self.assertRaises(PageNotFound, cache.fetch, self.grabber,
+                          'http://a/repomd.xml')
+        self.assertEqual([], os.listdir(self.cachedir))
+
+    def test_eviction(self):
+        '''least recently used entries are evicted over max_size'''
+        HttpCache(self.cachedir).fetch(self.grabber, 'http://a/repomd.xml')
+
+        cache = HttpCache(self.cachedir, max_size=2)
+        fname = cache.fetch(self.grabber, 'http://b/repomd.xml')
+
+        self.assertEqual(sorted([os.path.basename(fname),
+                                 os.path.basename(fname) + '.meta']),
+                         sorted(os.listdir(self.cachedir)))
+
+    def test_fetch_many(self):
+        '''results keep order of requests'''
+        cache = HttpCache(self.cachedir)
+        cache.fetch(self.grabber, 'http://b/repomd.xml')
+        results = cache.fetch_many(self.grabber,
+                                   [('http://a/repomd.xml', None, None, True),
+                                    ('http://c/repomd.xml', None, None, True),
+                                    ('http://b/repomd.xml', None, None, True)])
+
+        self.assertEqual('A', open(results[0]).read())
+        self.assertTrue(isinstance(results[1], PageNotFound))
+        self.assertEqual('BB', open(results[2]).read())
+        self.assertEqual(3, len(self.grabber.requests))
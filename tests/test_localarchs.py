@@ -0,0 +1,143 @@
+#!/usr/bin/python -tt
+# vim: ai ts=4 sts=4 et sw=4
+#
+# Copyright (c) 2012 Intel, Inc.
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation; version 2 of the License
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License
+# for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc., 59
+# Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+
+"""Unit tests of finding archs of local repos for gbs build"""
+
+import os
+import gzip
+import json
+import shutil
+import tempfile
+import unittest
+
+from mock import patch
+
+from gitbuildsys import cmd_build
+from gitbuildsys.cmd_build import ARCH_INDEX_NAME, ARCH_SAMPLE_THRESHOLD, \
+                                  SUPPORTEDARCHS, get_local_archs, \
+                                  load_arch_index, save_arch_index
+
+
+def write_repo(path, archs, revision='1'):
+    '''write repodata of local repo with a package of each of archs'''
+    repodata = os.path.join(path, 'repodata')
+    if os.path.exists(repodata):
+        shutil.rmtree(repodata)
+    os.makedirs(repodata)
+    with open(os.path.join(repodata, 'repomd.xml'), 'w') as fobj:
+        fobj.write('<repomd><revision>%s</revision></repomd>' % revision)
+    fobj = gzip.open(os.path.join(repodata, 'abc-primary.xml.gz'), 'wb')
+    fobj.write('<metadata xmlns="http://linux.duke.edu/metadata/common" '
+               'packages="%d">' % len(archs))
+    for num, arch in enumerate(archs):
+        fobj.write('<package type="rpm"><name>pkg%d</name>'
+                   '<arch>%s</arch></package>' % (num, arch))
+    fobj.write('</metadata>')
+    fobj.close()
+
+
+class LocalArchsTest(unittest.TestCase):
+    '''Test get_local_archs and its arch index'''
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix='test-gbs-localarchs-')
+        self.repo = os.path.join(self.tmpdir, 'repo')
+        self.index = os.path.join(self.repo, ARCH_INDEX_NAME)
+        patch.object(cmd_build, 'TMPDIR',
+                     os.path.join(self.tmpdir, 'tmp')).start()
+
+    def tearDown(self):
+        patch.stopall()
+        shutil.rmtree(self.tmpdir, True)
+
+    def load_index(self):
+        '''arch index saved next to repo'''
+        with open(self.index) as fobj:
+            return json.load(fobj)
+
+    def test_archs(self):
+        '''archs of packages are counted, source and noarch ones skipped'''
+        write_repo(self.repo, ['i686', 'i586', 'x86_64', 'noarch', 'src'])
+
+        self.assertEqual(set(['i586', 'x86_64']),
+                         get_local_archs([self.repo]))
+        index = self.load_index()
+        self.assertEqual({'i586': 2, 'x86_64': 1}, index['archs'])
+        self.assertTrue(index['complete'])
+
+    def test_threshold(self):
+        '''parsing stops once build arch has been seen enough times'''
+        write_repo(self.repo, ['armv7l'] * (ARCH_SAMPLE_THRESHOLD + 10) +
+                   ['x86_64'])
+
+        self.assertEqual(set(['armv7l']),
+                         get_local_archs([self.repo], 'armv7l'))
+        index = self.load_index()
+        self.assertEqual({'armv7l': ARCH_SAMPLE_THRESHOLD}, index['archs'])
+        self.assertFalse(index['complete'])
+
+        # partial index isn't enough for another arch
+        self.assertEqual(set(['armv7l', 'x86_64']),
+                         get_local_archs([self.repo], 'x86_64'))
+        self.assertTrue(self.load_index()['complete'])
+
+    def test_early_exit(self):
+        '''parsing stops once all supported archs have been found'''
+        other = os.path.join(self.tmpdir, 'other')
+        write_repo(self.repo, SUPPORTEDARCHS + ['x86_64'])
+        write_repo(other, ['x86_64'])
+
+        self.assertEqual(set(SUPPORTEDARCHS),
+                         get_local_archs([self.repo, other]))
+        self.assertFalse(self.load_index()['complete'])
+        self.assertFalse(os.path.exists(os.path.join(other,
+                                                     ARCH_INDEX_NAME)))
+
+    def test_index_reused(self):
+        '''index is used until repomd.xml changes'''
+        write_repo(self.repo, ['x86_64'])
+        get_local_archs([self.repo])
+
+        # same repomd.xml
+        write_repo(self.repo, ['aarch64'])
+        self.assertEqual(set(['x86_64']), get_local_archs([self.repo]))
+
+        write_repo(self.repo, ['aarch64'], revision='2')
+        self.assertEqual(set(['aarch64']), get_local_archs([self.repo]))
+        self.assertEqual({'aarch64': 1}, self.load_index()['archs'])
+
+    def test_index_in_tmpdir(self):
+        '''index goes under TMPDIR when it can't be saved next to repo'''
+        write_repo(self.repo, ['x86_64'])
+        # sidecar index can't replace a dir
+        os.makedirs(self.index)
+        index = {'checksum': 'abc', 'archs': {'x86_64': 1},
+                 'complete': True}
+
+        save_arch_index(self.repo, index)
+        self.assertEqual(['archindex'],
+                         os.listdir(os.path.join(self.tmpdir, 'tmp')))
+        self.assertEqual(index, load_arch_index(self.repo, 'abc'))
+        self.assertEqual(None, load_arch_index(self.repo, 'def'))
+        self.assertEqual(set(['x86_64']), get_local_archs([self.repo]))
+
+    def test_remote_and_missing_repos(self):
+        '''remote repos and repos without primary give no archs'''
+        os.makedirs(self.repo)
+        self.assertEqual(set(), get_local_archs(['http://example.com/repo',
+                                                 self.repo]))
@@ -0,0 +1,101 @@
+#!/usr/bin/python -tt
+# vim: ai ts=4 sts=4 et sw=4
+#
+# Copyright (c) 2012 Intel, Inc.
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation; version 2 of the License
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License
+# for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc., 59
+# Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+
+"""Unit tests of finding git projects for gbs export --batch"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from gitbuildsys.cmd_export import find_git_projects, parse_repo_manifest
+from gitbuildsys.errors import GbsError
+
+
+def write(path, content):
+    '''write content to path, creating dirs'''
+    if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    with open(path, 'w') as fobj:
+        fobj.write(content)
+
+
+class ManifestTest(unittest.TestCase):
+    '''Test parse_repo_manifest and find_git_projects'''
+
+    def setUp(self):
+        self.topdir = tempfile.mkdtemp(prefix='test-gbs-manifest-')
+        self.manifests = os.path.join(self.topdir, '.repo', 'manifests')
+        write(os.path.join(self.manifests, 'default.xml'),
+              '<manifest><project name="a"/>'
+              '<project name="pkgs/b" path="b"/>'
+              '<include name="extra.xml"/></manifest>')
+        write(os.path.join(self.manifests, 'extra.xml'),
+              '<manifest><project name="c"/>'
+              '<remove-project name="a"/></manifest>')
+        write(os.path.join(self.topdir, '.repo', 'manifest.xml'),
+              '<manifest><include name="default.xml"/></manifest>')
+
+    def tearDown(self):
+        shutil.rmtree(self.topdir, True)
+
+    def path(self, *names):
+        '''paths of names in topdir'''
+        return [os.path.join(self.topdir, name) for name in names]
+
+    def test_include_and_remove(self):
+        '''includes are followed and removed projects dropped'''
+        self.assertEqual(self.path('b', 'c'), parse_repo_manifest(
+            os.path.join(self.topdir, '.repo', 'manifest.xml'), self.topdir))
+
+    def test_repo_checkout(self):
+        '''manifest of repo checkout is used'''
+        self.assertEqual(self.path('b', 'c'), find_git_projects(self.topdir))
+
+    def test_manifest_in_manifests_dir(self):
+        '''projects of manifest in .repo/manifests are in checkout'''
+        self.assertEqual(self.path('b', 'c'), find_git_projects(
+            os.path.join(self.manifests, 'default.xml')))
+
+    def test_plain_manifest(self):
+        '''manifest out of repo checkout is relative to its dir'''
+        mandir = os.path.join(self.topdir, 'manifests')
+        write(os.path.join(mandir, 'default.xml'),
+              '<manifest><project name="d"/>'
+              '<include name="more.xml"/></manifest>')
+        write(os.path.join(mandir, 'more.xml'),
+              '<manifest><project name="e"/></manifest>')
+
+        projects = find_git_projects(os.path.join(mandir, 'default.xml'))
+        self.assertEqual([os.path.join(mandir, 'd'),
+                          os.path.join(mandir, 'e')], projects)
+
+    def test_bad_manifest(self):
+        '''unparsable manifest is reported'''
+        write(os.path.join(self.topdir, 'bad.xml'), '<manifest>')
+        self.assertRaises(GbsError, find_git_projects,
+                          os.path.join(self.topdir, 'bad.xml'))
+
+    def test_dir_of_git_projects(self):
+        '''git projects are found in dir, not nested ones'''
+        for name in ('x/.git/HEAD', 'x/y/.git/HEAD', 'z/w/.git'):
+            write(os.path.join(self.topdir, 'src', name), '')
+
+        self.assertEqual([os.path.join(self.topdir, 'src', 'x'),
+                          os.path.join(self.topdir, 'src', 'z', 'w')],
+                         find_git_projects(os.path.join(self.topdir, 'src')))
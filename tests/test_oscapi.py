@@ -0,0 +1,235 @@
+#!/usr/bin/python -tt
+# vim: ai ts=4 sts=4 et sw=4
+#
+# Copyright (c) 2012 Intel, Inc.
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation; version 2 of the License
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License
+# for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc., 59
+# Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+
+"""Unit tests of committing files to OBS by class OSC"""
+
+import os
+import base64
+import shutil
+import tempfile
+import threading
+import unittest
+import urllib2
+import BaseHTTPServer
+from StringIO import StringIO
+
+from mock import patch, MagicMock
+
+from gitbuildsys.errors import ObsError
+from gitbuildsys.oscapi import OSC, OSCError, UploadProgress
+
+APIURL = 'https://api.example.com'
+
+
+def http_error(url, code):
+    '''HTTPError of code for url'''
+    return urllib2.HTTPError(url, code, 'error %d' % code, {}, None)
+
+
+class FakeOpener(object):
+    '''urllib2 opener recording bodies of requests, failing by given codes'''
+
+    def __init__(self, codes=()):
+        self.codes = list(codes)
+        self.bodies = []
+
+    def open(self, req):
+        '''read body of request, raise HTTPError for next error code'''
+        self.bodies.append((req.get_full_url(), req.get_data().read()))
+        code = self.codes.pop(0) if self.codes else 200
+        if code != 200:
+            raise http_error(req.get_full_url(), code)
+        return StringIO('<status code="ok"/>')
+
+
+class AuthHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    '''HTTP handler challenging PUT requests without credentials'''
+
+    def do_PUT(self):
+        '''record body, reply 401 until credentials are given'''
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        self.server.bodies.append(body)
+        if self.headers.get('Authorization') is None:
+            self.send_response(401)
+            self.send_header('WWW-Authenticate', 'Basic realm="obs"')
+        else:
+            self.send_response(200)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, *args):
+        '''keep test output clean'''
+        pass
+
+
+class UploadTest(unittest.TestCase):
+    '''Test uploads of OSC.put_file and OSC.put_files'''
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix='test-gbs-oscapi-')
+        self.fpaths = []
+        for name, size in (('small', 10), ('large', 3000), ('medium', 200)):
+            fpath = os.path.join(self.tmpdir, name)
+            with open(fpath, 'w') as fobj:
+                fobj.write(name[0] * size)
+            self.fpaths.append(fpath)
+        with patch('gitbuildsys.oscapi.conf.get_config'):
+            self.osc = OSC(APIURL)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir, True)
+
+    def put_files(self, opener, threads=1):
+        '''put files of test by opener'''
+        with patch.object(OSC, 'upload_opener', return_value=opener):
+            with patch.object(OSC, 'upload_auth', return_value='Basic x'):
+                self.osc.put_files('prj', 'pkg', self.fpaths, threads)
+
+    def test_largest_first(self):
+        '''files are uploaded largest first'''
+        opener = FakeOpener()
+        self.put_files(opener)
+        self.assertEqual(['large', 'medium', 'small'],
+                         [url.split('?')[0].rsplit('/', 1)[-1]
+                          for url, _body in opener.bodies])
+
+    def test_failure_stops_uploads(self):
+        '''uploads not started yet are skipped after first failure'''
+        opener = FakeOpener([403])
+        self.assertRaises(OSCError, self.put_files, opener)
+        self.assertEqual(1, len(opener.bodies))
+
+    @patch('gitbuildsys.oscapi.time.sleep')
+    def test_server_error_retried(self, sleep):
+        '''server error restarts upload from the beginning'''
+        opener = FakeOpener([503, 502])
+        progress = UploadProgress(3000)
+        OSC.put_file('%s/large' % APIURL, self.fpaths[1], progress, opener)
+
+        self.assertEqual(['l' * 3000] * 3,
+                         [body for _url, body in opener.bodies])
+        self.assertEqual(2, sleep.call_count)
+        self.assertEqual(3000, progress.sent)
+
+    @patch('gitbuildsys.oscapi.time.sleep')
+    def test_client_error_not_retried(self, sleep):
+        '''client error fails upload at once'''
+        opener = FakeOpener([404])
+        progress = UploadProgress(3000)
+        self.assertRaises(OSCError, OSC.put_file, '%s/large' % APIURL,
+                          self.fpaths[1], progress, opener)
+        self.assertEqual(1, len(opener.bodies))
+        self.assertFalse(sleep.called)
+        self.assertEqual(0, progress.sent)
+
+    def test_body_sent_again_on_challenge(self):
+        '''whole file is sent again after authentication challenge'''
+        server = BaseHTTPServer.HTTPServer(('127.0.0.1', 0), AuthHandler)
+        server.bodies = []
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        try:
+            url = 'http://127.0.0.1:%d/source/prj/pkg/large' % \
+                  server.server_port
+            passwords = urllib2.HTTPPasswordMgrWithDefaultRealm()
+            passwords.add_password(None, url, 'user', 'secret')
+            opener = urllib2.build_opener(
+                urllib2.ProxyHandler({}),
+                urllib2.HTTPBasicAuthHandler(passwords))
+            progress = UploadProgress(3000)
+            OSC.put_file(url, self.fpaths[1], progress, opener)
+        finally:
+            server.shutdown()
+            server.server_close()
+
+        self.assertEqual(['l' * 3000] * 2, server.bodies)
+        self.assertEqual(3000, progress.sent)
+
+    def test_upload_auth(self):
+        '''credentials of apiurl are sent up front'''
+        options = {APIURL: {'user': 'user', 'pass': 'secret'}}
+        with patch.dict('gitbuildsys.oscapi.conf.config',
+                        {'api_host_options': options}):
+            self.assertEqual('Basic %s' % base64.b64encode('user:secret'),
+                             self.osc.upload_auth())
+
+
+class CommitFilesTest(unittest.TestCase):
+    '''Test OSC.commit_files with mocked replies of OBS'''
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix='test-gbs-oscapi-')
+        self.files = []
+        for name in ('foo.spec', 'foo.tar.gz'):
+            fpath = os.path.join(self.tmpdir, name)
+            with open(fpath, 'w') as fobj:
+                fobj.write(name)
+            self.files.append((fpath, True))
+        with patch('gitbuildsys.oscapi.conf.get_config'):
+            self.osc = OSC(APIURL)
+        self.patchers = [
+            patch('gitbuildsys.oscapi.conf.get_apiurl_usr',
+                  return_value='user'),
+            patch('gitbuildsys.oscapi.get_digest_cache',
+                  return_value=MagicMock())]
+        for patcher in self.patchers:
+            patcher.start()
+
+    def tearDown(self):
+        for patcher in self.patchers:
+            patcher.stop()
+        shutil.rmtree(self.tmpdir, True)
+
+    def commit(self, *replies):
+        '''commit files of test, OBS giving replies, return put_files mock'''
+        with patch.object(OSC, 'core_http',
+                          side_effect=[StringIO(reply) for reply in replies]):
+            with patch.object(OSC, 'put_files') as put_files:
+                self.osc.commit_files('prj', 'foo', self.files, 'message')
+        return put_files
+
+    def test_nothing_missing(self):
+        '''nothing is uploaded when OBS has all files'''
+        put_files = self.commit('<directory name="foo" rev="2"/>')
+        self.assertFalse(put_files.called)
+
+    def test_missing_uploaded(self):
+        '''only files OBS misses are uploaded'''
+        put_files = self.commit('<directory name="foo" error="missing">'
+                                '<entry name="foo.tar.gz"/></directory>',
+                                '<directory name="foo" rev="2"/>')
+        put_files.assert_called_once_with('prj', 'foo', [self.files[1][0]])
+
+    def test_still_missing(self):
+        '''files missing after upload fail commit'''
+        missing = '<directory name="foo" error="missing">' \
+                  '<entry name="foo.tar.gz"/></directory>'
+        self.assertRaises(ObsError, self.commit, missing, missing)
+
+    def test_unknown_reply_after_upload(self):
+        '''unparsable reply after upload fails commit'''
+        self.assertRaises(ObsError, self.commit,
+                          '<directory name="foo" error="missing">'
+                          '<entry name="foo.tar.gz"/></directory>',
+                          'Internal error')
+
+    def test_other_error(self):
+        '''errors other than missing files fail commit'''
+        self.assertRaises(ObsError, self.commit,
+                          '<directory name="foo" error="failed"/>')
@@ -0,0 +1,97 @@
+#!/usr/bin/python -tt
+# vim: ai ts=4 sts=4 et sw=4
+#
+# Copyright (c) 2012 Intel, Inc.
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation; version 2 of the License
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License
+# for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc., 59
+# Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+
+"""Unit tests for class SpecHeaderParser"""
+
+import unittest
+
+from gitbuildsys.utils import SpecHeaderParser, UnsupportedSpec
+
+
+def parse(content):
+    '''parse spec content'''
+    return SpecHeaderParser(content).parse()
+
+
+class SpecHeaderParserTest(unittest.TestCase):
+    '''Test SpecHeaderParser class'''
+
+    def test_plain_tags(self):
+        '''main tags without macros'''
+        info = parse('Name: foo\nVersion: 1.0\nRelease: 2\n'
+                     'Summary: Foo\n\n%description\nFoo\n')
+
+        self.assertEqual('foo', info.name)
+        self.assertEqual('1.0', info.upstreamversion)
+        self.assertEqual('2', info.release)
+        self.assertEqual({'upstreamversion': '1.0', 'release': '2'},
+                         info.version)
+
+    def test_define_and_global(self):
+        '''macros defined in spec are expanded'''
+        info = parse('%define major 1\n%global minor %{major}.2\n'
+                     'Name: foo\nVersion: %{minor}\nRelease: %major\n'
+                     'Source0: %{name}-%{version}.tar.gz\n')
+
+        self.assertEqual('1.2', info.upstreamversion)
+        self.assertEqual('1', info.release)
+
+    def test_epoch(self):
+        '''epoch is part of version'''
+        info = parse('Name: foo\nVersion: 1\nRelease: 1\nEpoch: 3\n')
+
+        self.assertEqual('3', info.version['epoch'])
+
+    def test_unknown_macro(self):
+        '''macros of rpm macro files are left to rpm'''
+        self.assertRaises(UnsupportedSpec, parse,
+                          'Name: foo\nVersion: 1\nRelease: 1%{?dist}\n')
+
+    def test_conditional(self):
+        '''conditionals before main tags are left to rpm'''
+        self.assertRaises(UnsupportedSpec, parse,
+                          'Name: foo\n%if 0\nVersion: 1\n%else\nVersion: 2\n'
+                          '%endif\nRelease: 1\n')
+
+    def test_conditional_after_main_tags(self):
+        '''constructs after main tags don't affect them'''
+        info = parse('Name: foo\nVersion: 1\nRelease: 1\n'
+                     '%if 0%{?tizen}\nBuildRequires: bar\n%endif\n')
+
+        self.assertEqual('foo', info.name)
+
+    def test_missing_tag(self):
+        '''all main tags must be found before first section'''
+        self.assertRaises(UnsupportedSpec, parse,
+                          'Name: foo\nVersion: 1\n%description\nRelease: 1\n')
+
+    def test_shell_macro(self):
+        '''shell output macros are left to rpm'''
+        self.assertRaises(UnsupportedSpec, parse,
+                          '%define ver %(echo 1.0)\n'
+                          'Name: foo\nVersion: %{ver}\nRelease: 1\n')
+
+    def test_expression_macro(self):
+        '''expression macros are left to rpm'''
+        self.assertRaises(UnsupportedSpec, parse,
+                          'Name: foo\nVersion: %[1+1]\nRelease: 1\n')
+
+    def test_unexpanded_tag(self):
+        '''percent left in tag value after expansion is left to rpm'''
+        self.assertRaises(UnsupportedSpec, parse,
+                          'Name: foo\nVersion: 1%%\nRelease: 1\n')
@@ -0,0 +1,168 @@
+#!/usr/bin/python -tt
+# vim: ai ts=4 sts=4 et sw=4
+#
+# Copyright (c) 2012 Intel, Inc.
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation; version 2 of the License
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License
+# for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc., 59
+# Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+
+"""Unit tests of normalize_tarball"""
+
+import os
+import bz2
+import gzip
+import shutil
+import subprocess
+import tarfile
+import tempfile
+import unittest
+from StringIO import StringIO
+
+from gitbuildsys.utils import find_binary_path, normalize_tarball
+
+GIT_ENV = dict(os.environ, GIT_AUTHOR_NAME='test',
+               GIT_AUTHOR_EMAIL='test@localhost', GIT_COMMITTER_NAME='test',
+               GIT_COMMITTER_EMAIL='test@localhost',
+               GIT_AUTHOR_DATE='1400000000 +0000',
+               GIT_COMMITTER_DATE='1400000000 +0000')
+
+
+def git(path, *args):
+    '''run git command in path, return its output'''
+    return subprocess.check_output(('git',) + args, cwd=path, env=GIT_ENV)
+
+
+class NormalizeTarballTest(unittest.TestCase):
+    '''Test normalize_tarball'''
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp(prefix='test-gbs-tarball-')
+        self.repo = os.path.join(self.path, 'repo')
+        os.makedirs(os.path.join(self.repo, 'src'))
+        for name in ('README', 'src/main.c'):
+            with open(os.path.join(self.repo, name), 'w') as fobj:
+                fobj.write('%s\n' % name)
+        git(self.repo, 'init', '-q')
+        git(self.repo, 'add', '.')
+        git(self.repo, 'commit', '-q', '-m', 'initial')
+
+    def tearDown(self):
+        shutil.rmtree(self.path, True)
+
+    def archive(self, name, treeish, gzip_mtime=None, compressor=None):
+        '''
+        git archive treeish to tarball name, gzipped if gzip_mtime or
+        compressed by compressor program
+        '''
+        content = git(self.repo, 'archive', '--format=tar',
+                      '--prefix=foo-1.0/', treeish)
+        path = os.path.join(self.path, name)
+        if compressor:
+            proc = subprocess.Popen([compressor, '-c'], stdin=subprocess.PIPE,
+                                    stdout=subprocess.PIPE)
+            with open(path, 'wb') as fobj:
+                fobj.write(proc.communicate(content)[0])
+        elif gzip_mtime is None:
+            with open(path, 'wb') as fobj:
+                fobj.write(content)
+        else:
+            gzf = gzip.GzipFile(path, 'wb', mtime=gzip_mtime)
+            gzf.write(content)
+            gzf.close()
+        return path
+
+    def test_identical_bytes(self):
+        '''same tree gives same bytes whatever the gzip header has'''
+        first = self.archive('first.tar.gz', 'HEAD', gzip_mtime=1)
+        second = self.archive('second.tar.gz', 'HEAD', gzip_mtime=2)
+        self.assertNotEqual(open(first, 'rb').read(),
+                            open(second, 'rb').read())
+
+        self.assertTrue(normalize_tarball(first, 12345))
+        self.assertTrue(normalize_tarball(second, 12345))
+        self.assertEqual(open(first, 'rb').read(), open(second, 'rb').read())
+
+    def test_commit_archive(self):
+        '''commit id is dropped and commit time kept'''
+        path = self.archive('foo.tar', 'HEAD')
+        self.assertTrue('comment' in tarfile.open(path).pax_headers)
+
+        normalize_tarball(path, 12345)
+        tar = tarfile.open(path)
+        self.assertEqual({}, tar.pax_headers)
+        self.assertEqual(set([1400000000]),
+                         set(member.mtime for member in tar))
+
+    def test_tree_archive(self):
+        '''entries of tree archive get given mtime and root owner'''
+        path = self.archive('foo.tar.gz', 'HEAD^{tree}', gzip_mtime=1)
+
+        normalize_tarball(path, 12345)
+        members = tarfile.open(path).getmembers()
+        self.assertEqual(['foo-1.0', 'foo-1.0/README', 'foo-1.0/src',
+                          'foo-1.0/src/main.c'],
+                         [member.name for member in members])
+        self.assertEqual(set([(12345, 0, 0, 'root', 'root')]),
+                         set((member.mtime, member.uid, member.gid,
+                              member.uname, member.gname)
+                             for member in members))
+
+    def test_not_tarball(self):
+        '''other files are left untouched'''
+        path = os.path.join(self.path, 'foo.patch')
+        with open(path, 'w') as fobj:
+            fobj.write('patch')
+
+        self.assertFalse(normalize_tarball(path, 12345))
+        self.assertEqual('patch', open(path).read())
+
+    def check_normalized(self, content):
+        '''tar content has tree entries normalized'''
+        members = tarfile.open(fileobj=StringIO(content)).getmembers()
+        self.assertEqual(['foo-1.0', 'foo-1.0/README', 'foo-1.0/src',
+                          'foo-1.0/src/main.c'],
+                         [member.name for member in members])
+        self.assertEqual(set([(12345, 'root')]),
+                         set((member.mtime, member.uname)
+                             for member in members))
+
+    def test_bzip2(self):
+        '''bzip2 tarball is normalized and stays bzip2'''
+        path = self.archive('foo.tar.bz2', 'HEAD^{tree}', compressor='bzip2')
+
+        self.assertTrue(normalize_tarball(path, 12345))
+        self.check_normalized(bz2.BZ2File(path).read())
+
+    def test_external_compressors(self):
+        '''xz and zstd tarballs are normalized and stay compressed'''
+        for name, compressor in (('foo.tar.xz', 'xz'),
+                                 ('foo.tar.zst', 'zstd')):
+            if not find_binary_path(compressor):
+                continue
+            path = self.archive(name, 'HEAD^{tree}', compressor=compressor)
+
+            self.assertTrue(normalize_tarball(path, 12345))
+            normalized = open(path, 'rb').read()
+            self.check_normalized(subprocess.check_output(
+                [compressor, '-d', '-c', path]))
+            normalize_tarball(path, 12345)
+            self.assertEqual(normalized, open(path, 'rb').read())
+
+    def test_unsupported_compression(self):
+        '''tarballs of unknown compression are left untouched'''
+        path = os.path.join(self.path, 'foo.tar.lz')
+        with open(path, 'w') as fobj:
+            fobj.write('lzip')
+
+        self.assertFalse(normalize_tarball(path, 12345))
+        self.assertEqual('lzip', open(path).read())
@@ -0,0 +1,113 @@
+#!/usr/bin/python -tt
+# vim: ai ts=4 sts=4 et sw=4
+#
+# Copyright (c) 2012 Intel, Inc.
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation; version 2 of the License
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License
+# for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc., 59
+# Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+
+"""Unit tests of gbs remotebuild --watch"""
+
+import unittest
+from StringIO import StringIO
+
+from mock import patch
+
+from gitbuildsys.cmd_remotebuild import watch_results
+from gitbuildsys.oscapi import OSC
+
+APIURL = 'https://api.example.com'
+
+
+def resultlist(state, *results):
+    '''_result reply of OBS for (repository, arch, code, dirty) results'''
+    xml = '<resultlist state="%s">' % state
+    for repo, arch, code, dirty in results:
+        xml += '<result project="prj" repository="%s" arch="%s" ' \
+               'code="%s" state="%s"%s><status package="foo" code="%s"/>' \
+               '</result>' % (repo, arch, code, code,
+                              ' dirty="true"' if dirty else '', code)
+    return xml + '</resultlist>'
+
+
+class WatchResultsTest(unittest.TestCase):
+    '''Test watch_results of gbs remotebuild with mocked OBS replies'''
+
+    def setUp(self):
+        with patch('gitbuildsys.oscapi.conf.get_config'):
+            self.osc = OSC(APIURL)
+        self.sleep = patch('gitbuildsys.oscapi.time.sleep').start()
+        self.log = patch('gitbuildsys.cmd_remotebuild.log').start()
+
+    def tearDown(self):
+        patch.stopall()
+
+    def watch(self, *replies):
+        '''watch results OBS replies, return exit code and urls polled'''
+        with patch.object(OSC, 'core_http',
+                          side_effect=[StringIO(reply) for reply in replies]) \
+                as core_http:
+            ret = watch_results(self.osc, 'prj', 'foo')
+        return ret, [call[0][1] for call in core_http.call_args_list]
+
+    def lines(self):
+        '''lines logged at info level, except the first one'''
+        return [call[0][0] for call in self.log.info.call_args_list][1:]
+
+    def test_transitions(self):
+        '''changes are printed until results are final'''
+        ret, urls = self.watch(
+            resultlist('s1', ('standard', 'i586', 'scheduled', False),
+                       ('standard', 'x86_64', 'excluded', False)),
+            resultlist('s2', ('standard', 'i586', 'building', False),
+                       ('standard', 'x86_64', 'excluded', False)),
+            resultlist('s3', ('standard', 'i586', 'succeeded', True),
+                       ('standard', 'x86_64', 'excluded', False)),
+            resultlist('s4', ('standard', 'i586', 'succeeded', False),
+                       ('standard', 'x86_64', 'excluded', False)))
+
+        self.assertEqual(0, ret)
+        self.assertEqual(['standard       i586           scheduled',
+                          'standard       x86_64         excluded',
+                          'standard       i586           scheduled -> '
+                          'building',
+                          'standard       i586           building -> '
+                          'succeeded'], self.lines())
+        self.assertEqual(4, len(urls))
+        self.assertFalse('oldstate' in urls[0])
+        self.assertTrue('oldstate=s3' in urls[3])
+        # unchanged results are polled again after a delay
+        self.assertEqual(1, self.sleep.call_count)
+
+    def test_failed(self):
+        '''any failed build gives exit code 1'''
+        ret = self.watch(
+            resultlist('s1', ('standard', 'i586', 'failed', False),
+                       ('standard', 'x86_64', 'succeeded', False)))[0]
+        self.assertEqual(1, ret)
+
+    def test_waiting_for_results(self):
+        '''results are waited for after commit'''
+        ret, urls = self.watch(
+            resultlist('s1'), resultlist('s1'),
+            resultlist('s2', ('standard', 'i586', 'succeeded', False)))
+        self.assertEqual(0, ret)
+        self.assertEqual(3, len(urls))
+
+    @patch('gitbuildsys.oscapi.WATCH_NO_RESULTS_TIMEOUT', -1)
+    def test_no_results(self):
+        '''no results at all give exit code 1'''
+        ret, urls = self.watch(resultlist('s1'))
+        self.assertEqual(1, ret)
+        self.assertEqual(1, len(urls))
+        self.assertTrue(self.log.error.called)